@@ -1,48 +1,234 @@
-from flask import Flask, render_template, request
+from flask import (
+    Flask,
+    jsonify,
+    render_template,
+    request,
+    stream_template,
+)
 from pymongo import MongoClient
-from gensim.models.doc2vec import Doc2Vec
-from train.train import transform_instance, pgraph_pipeline, title_pipeline
-from collections import Counter
-from urllib.parse import urlparse
+from train.train import keyword_pipeline
+from train.bundle import load_bundle
+from metrics import (
+    CONTENT_TYPE,
+    MetricsRegistry,
+    array_bytes,
+    resident_memory_bytes,
+)
+from query_cache import QueryCache
+from registry import ArtifactRegistry
+from bson import ObjectId
+from collections import Counter, namedtuple
 
-import joblib
 import numpy as np
-import pickle
+import os
+import time
 
-with open("model.pkl", "rb") as f:
-    clf2 = pickle.load(f)
+BUNDLE_DIR = os.environ.get("BUNDLE_DIR", "bundle")
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 600  # seconds
+RELOAD_POLL_INTERVAL = 5  # seconds between checks of the bundle pointer
+MONGO_HOST = os.environ.get("MONGO_HOST", "localhost")
+MONGO_PORT = int(os.environ.get("MONGO_PORT", 27017))
+MONGO_POOL_SIZE = 20
+QUERY_DEFAULT_TOP = 30  # docs per page, like the HN front page
+QUERY_MAX_TOP = 500
+API_MAX_QUERIES = 1000
+API_DEFAULT_TOP = 10
+API_MAX_TOP = QUERY_MAX_TOP
+# docs per /query page
+RESULT_SIZE_BUCKETS = [0, 1, 5, 10, 20, 30, 50, 100, 250, 500]
+
+# ranked related docs of one query: bundle rows, distances and cluster label
+RankedDocs = namedtuple("RankedDocs", ["rows", "distances", "label"])
+NO_MATCH = RankedDocs(np.empty(0, dtype=np.int64), np.empty(0), None)
 
 app = Flask("personalized hackernews", template_folder="templates")
 
-client = MongoClient("localhost", 27017, maxPoolSize=20)
-db = client.hndb
-collection = db["filtered_hn_sites"]
-docs = list(collection.find().sort("_id", 1))
+_mongo = {"pid": None, "client": None}
+
+
+def get_collection():
+    # MongoClient is not fork safe: every process (e.g. each serve.py
+    # worker) opens its own pooled client on first use
+    if _mongo["pid"] != os.getpid():
+        _mongo["client"] = MongoClient(
+            MONGO_HOST, MONGO_PORT, maxPoolSize=MONGO_POOL_SIZE, connect=False
+        )
+        _mongo["pid"] = os.getpid()
+    return _mongo["client"].hndb["filtered_hn_sites"]
+
+
+def fetch_documents(gen, rows, fields):
+    # full documents of bundle rows by doc id, fetched with one projected
+    # $in query when more than the metadata store holds is needed. ObjectIds
+    # (e.g. "_id") are returned as strings, so documents can be jsonified.
+    doc_ids = np.unique(gen.bundle.doc_ids[rows]).tolist()
+    if not doc_ids:
+        return {}
+    found = {}
+    for doc in get_collection().find(
+        {"_id": {"$in": [ObjectId(doc_id) for doc_id in doc_ids]}},
+        projection=fields,
+    ):
+        found[str(doc["_id"])] = {
+            field: str(value) if isinstance(value, ObjectId) else value
+            for field, value in doc.items()
+        }
+    return found
+
+
+query_cache = QueryCache(max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+# served at /metrics. Stages: tokenize, then on query cache misses
+# keyword_search, vector_lookup, predict and rank, then metadata and render
+# (render is not timed for streamed pages)
+metrics = MetricsRegistry()
+query_stage_seconds = metrics.histogram(
+    "hn_query_stage_seconds",
+    "Seconds spent in each stage of a search.",
+    label_names=["stage"],
+)
+query_seconds = metrics.histogram(
+    "hn_query_seconds",
+    "Seconds to serve a /query request, by outcome.",
+    label_names=["outcome"],
+)
+query_requests = metrics.counter(
+    "hn_query_requests_total",
+    "/query requests by outcome: empty_keywords, no_match or success.",
+    label_names=["outcome"],
+)
+query_result_size = metrics.histogram(
+    "hn_query_result_size",
+    "Docs returned per /query page.",
+    buckets=RESULT_SIZE_BUCKETS,
+)
+# array bytes of the served generation's artifacts, by version
+_artifact_bytes = {}
+
+
+def collect_artifact_bytes():
+    generation = registry.current()
+    if generation is None:
+        return []
+    if generation.version not in _artifact_bytes:
+        samples = []
+        for name, artifact in sorted(vars(generation.bundle).items()):
+            heap, mapped = array_bytes(artifact)
+            if heap or mapped:
+                samples.append(({"artifact": name, "storage": "heap"}, heap))
+                samples.append(
+                    ({"artifact": name, "storage": "mapped"}, mapped)
+                )
+        _artifact_bytes.clear()
+        _artifact_bytes[generation.version] = samples
+    return _artifact_bytes[generation.version]
+
+
+def collect_resident_memory():
+    rss = resident_memory_bytes()
+    return [] if rss is None else [({}, rss)]
+
+
+metrics.gauge(
+    "hn_artifact_bytes",
+    "Bytes of the arrays of the served model artifacts (vector and keyword "
+    "indexes, doc metadata); mapped arrays are memory mapped and shared "
+    "between processes.",
+    collect_artifact_bytes,
+)
+metrics.gauge(
+    "process_resident_memory_bytes",
+    "Resident memory of the serving process.",
+    collect_resident_memory,
+)
+metrics.gauge(
+    "hn_query_cache_entries",
+    "Entries in the query cache.",
+    lambda: [({}, query_cache.stats()["size"])],
+)
+
+
+def load_generation(version):
+    # inference-only artifacts exported by train.py, memory mapped. Docs are
+    # rendered from the bundle's metadata store, not loaded from Mongo.
+    return {"bundle": load_bundle(BUNDLE_DIR, version=version)}
+
+
+def on_swap(generation):
+    query_cache.set_version(generation.version)
+
+
+registry = ArtifactRegistry(
+    BUNDLE_DIR,
+    load_generation,
+    poll_interval=RELOAD_POLL_INTERVAL,
+    on_swap=on_swap,
+)
+# loaded at import, so serve.py loads it once before forking workers
+registry.load()
+
+
+def pick_samples_of_label(index, of_labels, doc_vecs, top=None):
+    # for every doc_vec, rank the docs of its cluster in `of_labels` by
+    # distance, returning the `top` closest ones (the whole cluster if top
+    # is None) with their distances
+    return index.search_batch(doc_vecs, of_labels, k=top)
+
+
+def rank_related_docs(gen, queries, top=None):
+    # for every query (a list of keywords, each a list of terms) rank the
+    # docs related to its best keyword match, closest first. Vectors of all
+    # matched docs are labelled and ranked in batch.
+    results = [NO_MATCH] * len(queries)
+    matched, relevant_rows = [], []
+    with query_stage_seconds.time(stage="keyword_search"):
+        for i, keyword_terms in enumerate(queries):
+            rows, _ = gen.bundle.keyword_index.search(
+                keyword_terms, mode="or", k=1
+            )
+            if len(rows):
+                matched.append(i)
+                relevant_rows.append(rows[0])
+    if not matched:
+        return results
 
-kmeans_model = pickle.load(open("model.pkl", "rb"))
-gensim_model = Doc2Vec.load("gensim.model")
+    # keyword index rows are bundle rows, so the stored vectors (already
+    # standardized) are looked up instead of re-inferred
+    with query_stage_seconds.time(stage="vector_lookup"):
+        scaled_vecs = gen.bundle.vectors(relevant_rows)
+    with query_stage_seconds.time(stage="predict"):
+        doc_labels = gen.bundle.predict(scaled_vecs)
 
-labels = kmeans_model.labels_
-centroids = kmeans_model.cluster_centers_
+    # related docs to keywords
+    with query_stage_seconds.time(stage="rank"):
+        ranked = pick_samples_of_label(
+            gen.bundle.index, doc_labels, scaled_vecs, top=top
+        )
+    for i, label, (rows, dists) in zip(matched, doc_labels, ranked):
+        results[i] = RankedDocs(rows, dists, int(label))
+    return results
 
-X_vectors = np.load("X_vectors.npy")
 
+def tokenize_keywords(keywords):
+    # comma-separated keywords (or a list of them) to tuples of terms,
+    # deduplicated and sorted, so identical searches rank and are cached
+    # the same whatever their keyword order or repetitions
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    return sorted(
+        set(
+            tuple(sorted(set(terms or [])))
+            for terms in keyword_pipeline.transform_many(
+                [[kw.strip()] for kw in keywords]
+            )
+        )
+    )
 
-def pick_samples_of_label(
-    doc_vecs, labels, of_label, doc_vec, sample=10, top=10
-):
-    # pick docs that are closest to of_label, sampling `sample` amount
-    # and picking the `top` ones
-    label_idxs = np.equal(labels, of_label).nonzero()[0]
-    label_vecs = doc_vecs[label_idxs]
-    dists = np.linalg.norm(label_vecs - doc_vec, axis=1)
-    assert len(label_vecs) == len(
-        label_idxs
-    ), f"Lengths must be same, but {len(label_vecs)} != {len(label_idxs)}"
-    dists_idx = list(zip(dists, label_idxs))
-    sorted_dists = sorted(dists_idx, key=lambda x: x[0])
 
-    return [idx for _, idx in sorted_dists]
+def query_key(keyword_terms, top):
+    # keyword_terms as returned by tokenize_keywords
+    return (tuple(keyword_terms), top)
 
 
 @app.route("/")
@@ -52,62 +238,163 @@ def index():
 
 @app.route("/query")
 def get_posts():
+    start_time = time.perf_counter()
     keywords = request.args.get("keywords", default="")
     if keywords == "":
-        return
-
-    # pipeline expects list of words
-    # relevant_doc = list(collection.find({ '$text': {'$search': keywords,
-    #     '$caseSensitive': False}}))
-
-    keywords = [word.strip() for word in keywords.split(",")]
-    keywords_match = [{"paragraphs": {"$regex": kw}} for kw in keywords]
-    # print("keywords_match: ", keywords_match)
-    relevant_doc = list(
-        collection.aggregate(
-            [
-                {"$unwind": "$paragraphs"},
-                {"$match": {"$or": keywords_match}},
-                {"$group": {"_id": "$_id", "count": {"$sum": 1}}},
-                {"$sort": {"count": -1}},
-            ]
+        query_requests.inc(outcome="empty_keywords")
+        page = render_template("index.html", table_data=[])
+        query_seconds.observe(
+            time.perf_counter() - start_time, outcome="empty_keywords"
         )
+        return page, 200
+
+    # page through the ranked docs with top/offset; stream=1 renders rows
+    # to the client as they are produced
+    top = min(
+        max(request.args.get("top", QUERY_DEFAULT_TOP, type=int), 1),
+        QUERY_MAX_TOP,
     )
-    # print("relevant doc by search by keyword: ", relevant_doc)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    stream = request.args.get("stream", default="0") == "1"
+
+    # the whole request is served by the generation current at its start
+    gen = registry.current()
+
+    # rank docs by keywords through the in-memory keyword index
+    with query_stage_seconds.time(stage="tokenize"):
+        keyword_terms = tokenize_keywords(keywords)
+    related = query_cache.get_or_compute(
+        query_key(keyword_terms, offset + top),
+        lambda: rank_related_docs(gen, [keyword_terms], top=offset + top)[0],
+        version=gen.version,
+    )
+    page_rows = related.rows[offset : offset + top]
+    outcome = "no_match" if related.label is None else "success"
+    query_requests.inc(outcome=outcome)
+    query_result_size.observe(len(page_rows))
+
+    context = {
+        "keywords": keywords,
+        "start": offset,
+        # a full page may be followed by more related docs
+        "next_offset": offset + top if len(page_rows) == top else None,
+        "top": top,
+    }
+    if stream:
+        table_data = (gen.bundle.metadata.row(i) for i in page_rows)
+        response = app.response_class(
+            stream_template("index.html", table_data=table_data, **context)
+        )
+        query_seconds.observe(
+            time.perf_counter() - start_time, outcome=outcome
+        )
+        return response, 200
+    with query_stage_seconds.time(stage="metadata"):
+        related_docs = gen.bundle.metadata.rows(page_rows)
+
+    with query_stage_seconds.time(stage="render"):
+        page = render_template(
+            "index.html", table_data=related_docs, **context
+        )
+    query_seconds.observe(time.perf_counter() - start_time, outcome=outcome)
+    return page, 200
 
-    if len(relevant_doc) == 0:
+
+@app.route("/api/query", methods=["POST"])
+def api_query():
+    # batched search: {"queries": ["rust, async", ["gpu", "cuda"], ...],
+    # "top": 10} returns the related doc ids, distances and cluster label
+    # of every query, in order. Mongo fields listed in "fields" (e.g.
+    # ["paragraphs"]) are fetched for the related docs.
+    body = request.get_json(silent=True) or {}
+    queries = body.get("queries")
+    top = body.get("top", API_DEFAULT_TOP)
+    fields = body.get("fields")
+    if not isinstance(queries, list) or len(queries) > API_MAX_QUERIES:
         return (
-            render_template(
-                "index.html",
-                table_data=[],
+            jsonify(
+                error="expected a list of at most {} queries".format(
+                    API_MAX_QUERIES
+                )
             ),
-            200,
+            400,
+        )
+    if not all(
+        isinstance(query, str)
+        or (
+            isinstance(query, list)
+            and all(isinstance(keyword, str) for keyword in query)
+        )
+        for query in queries
+    ):
+        return (
+            jsonify(error="every query must be a string or a list of strings"),
+            400,
         )
+    # bool is an int, but JSON true is no count
+    if isinstance(top, bool) or not isinstance(top, int) or top < 1:
+        return jsonify(error="top must be a positive integer"), 400
+    top = min(top, API_MAX_TOP)
+    if fields is not None and not (
+        isinstance(fields, list)
+        and all(isinstance(field, str) for field in fields)
+    ):
+        return jsonify(error="fields must be a list of field names"), 400
 
-    relevant_doc_id = relevant_doc[0]["_id"]
-    relevant_doc = collection.find_one({"_id": relevant_doc_id})
+    gen = registry.current()
+    keyword_terms = [tokenize_keywords(query) for query in queries]
+    keys = [query_key(terms, top) for terms in keyword_terms]
+    ranked = [query_cache.get(key, version=gen.version) for key in keys]
+    missing = [i for i, related in enumerate(ranked) if related is None]
+    if missing:
+        computed = rank_related_docs(
+            gen, [keyword_terms[i] for i in missing], top=top
+        )
+        for i, related in zip(missing, computed):
+            ranked[i] = related
+            query_cache.put(keys[i], related, version=gen.version)
 
-    title_data, pgraph_data = transform_instance(
-        relevant_doc, title_pipeline, pgraph_pipeline, DEBUG=False
-    )
-    word_vec = title_data + pgraph_data
-    feature_vec = gensim_model.infer_vector(word_vec).reshape(1, -1)
-    scaler_filename = "scaler.save"
-    scaler = joblib.load(scaler_filename)
+    results = []
+    for query, related in zip(queries, ranked):
+        results.append(
+            {
+                "query": query,
+                "label": related.label,
+                "doc_ids": gen.bundle.doc_ids[related.rows].tolist(),
+                "distances": related.distances.tolist(),
+                "docs": gen.bundle.metadata.rows(related.rows),
+            }
+        )
+    if fields:
+        # the related docs of all queries in a single round trip
+        rows = np.concatenate(
+            [related.rows for related in ranked] + [NO_MATCH.rows]
+        )
+        found = fetch_documents(gen, rows, fields)
+        for result in results:
+            for doc_id, doc in zip(result["doc_ids"], result["docs"]):
+                full_doc = found.get(doc_id, {})
+                for field in fields:
+                    doc[field] = full_doc.get(field)
+    return jsonify(version=gen.version, results=results)
 
-    doc_label = kmeans_model.predict(scaler.transform(feature_vec))[0]
 
-    # related docs to keywords
-    related_docs_idxs = pick_samples_of_label(
-        X_vectors, labels, doc_label, feature_vec
-    )
+@app.route("/version")
+def version():
+    return jsonify(registry.status())
+
+
+@app.route("/cache_stats")
+def cache_stats():
+    return jsonify(query_cache.stats())
 
-    related_docs = [docs[i] for i in related_docs_idxs]
-    for doc in related_docs:
-        doc["domain_name"] = urlparse(doc["href"][0]).netloc
-    print("related_docs keys: ", related_docs[0].keys())
 
-    return (render_template("index.html", table_data=related_docs), 200)
+@app.route("/metrics")
+def get_metrics():
+    return app.response_class(metrics.render(), content_type=CONTENT_TYPE)
 
 
-app.run(host="0.0.0.0", port=5000)
+if __name__ == "__main__":
+    # development server; use serve.py in production
+    registry.start()
+    app.run(host="0.0.0.0", port=5000)
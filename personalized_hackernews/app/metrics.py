@@ -0,0 +1,218 @@
+from contextlib import contextmanager
+
+import mmap
+import numpy as np
+import os
+import threading
+import time
+
+# seconds; the last bucket of every histogram is +Inf
+LATENCY_BUCKETS = [
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+]
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(name, _escape(value)) for name, value in labels
+        )
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.type = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.label_names, key)), value
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, label_names=()):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets) + [float("inf")]
+        self.label_names = tuple(label_names)
+        self.type = "histogram"
+        self._values = {}  # labels -> [bucket counts, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        i = int(np.searchsorted(self.buckets, value))
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0)
+            )
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        # observe the seconds the with block took
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + "_bucket", labels + [
+                    ("le", _format_value(float(bound)))
+                ], cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+
+class Gauge:
+    # values computed at scrape time: collect() returns (labels dict,
+    # value) pairs
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.type = "gauge"
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, sorted(labels.items()), value
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process, rendered in the Prometheus text format.
+    Under serve.py every worker process keeps its own metrics, so a scrape
+    sees the worker that served it.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label_names=()):
+        return self._add(Counter(name, help, label_names))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, label_names=()):
+        return self._add(Histogram(name, help, buckets, label_names))
+
+    def gauge(self, name, help, collect):
+        return self._add(Gauge(name, help, collect))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append(
+                    "{}{} {}".format(
+                        name, _format_labels(labels), _format_value(value)
+                    )
+                )
+        return "\n".join(lines) + "\n"
+
+
+def array_bytes(obj, max_depth=3):
+    # (heap bytes, memory mapped bytes) of the numpy arrays reachable from
+    # obj through attributes, dicts, lists and tuples, up to max_depth
+    # levels down, views counted once with the array they view. Python
+    # objects besides arrays are not counted.
+    seen = set()
+
+    def walk(value, depth):
+        if isinstance(value, np.ndarray):
+            while isinstance(value.base, np.ndarray):
+                value = value.base
+        if id(value) in seen:
+            return 0, 0
+        seen.add(id(value))
+        if isinstance(value, np.ndarray):
+            if isinstance(value, np.memmap) or isinstance(
+                value.base, mmap.mmap
+            ):
+                return 0, value.nbytes
+            return value.nbytes, 0
+        if depth == 0:
+            return 0, 0
+        if isinstance(value, dict):
+            children = value.values()
+        elif isinstance(value, (list, tuple)):
+            children = value
+        elif hasattr(value, "__dict__"):
+            children = vars(value).values()
+        else:
+            return 0, 0
+        heap, mapped = 0, 0
+        for child in children:
+            child_heap, child_mapped = walk(child, depth - 1)
+            heap += child_heap
+            mapped += child_mapped
+        return heap, mapped
+
+    return walk(obj, max_depth)
+
+
+def resident_memory_bytes():
+    # resident set size of this process, or None where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
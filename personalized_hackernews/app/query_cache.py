@@ -0,0 +1,134 @@
+from collections import OrderedDict
+
+import threading
+import time
+
+
+class _Flight:
+    # a computation in progress that concurrent callers wait on
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QueryCache:
+    """
+    Bounded LRU cache with a TTL for query results.
+
+    Concurrent lookups of the same missing key are coalesced: the first
+    caller computes the value while the others wait for it. Entries are
+    tagged with the model version they were computed with and the cache
+    empties itself when the version changes.
+    """
+
+    def __init__(self, max_entries=1024, ttl=600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def set_version(self, version):
+        # drop every entry if the model artifacts changed
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key, version=None):
+        # cached value of key, or None. Does not wait for computations in
+        # flight.
+        with self._lock:
+            key = (self.version if version is None else version, key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version=None):
+        with self._lock:
+            key = (self.version if version is None else version, key)
+            if key[0] == self.version:
+                self._put(key, value)
+
+    def get_or_compute(self, key, compute, version=None):
+        # `version` is the model version the value is computed with. A
+        # value computed with an outdated version is returned but not
+        # cached.
+        with self._lock:
+            key = (self.version if version is None else version, key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if flight.error is None and key[0] == self.version:
+                    self._put(key, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def _put(self, key, value):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,118 @@
+from train.bundle import current_version
+
+import threading
+import time
+import traceback
+
+
+class Generation:
+    # everything one model version needs to serve requests. Requests hold
+    # on to the generation they started with, so a swap never changes the
+    # models under a request in flight.
+    def __init__(self, version, loaded_at, load_seconds, **artifacts):
+        self.version = version
+        self.loaded_at = loaded_at
+        self.load_seconds = load_seconds
+        self.__dict__.update(artifacts)
+
+
+class ArtifactRegistry:
+    """
+    Serves the artifact generation named by the bundle's CURRENT file and
+    hot swaps to a new one when it changes.
+
+    `loader(version)` returns a dict of artifacts for a version. New
+    versions are loaded on a background thread and swapped in with a
+    single reference assignment once fully loaded; a version that fails to
+    load is skipped until CURRENT changes again.
+    """
+
+    def __init__(self, root, loader, poll_interval=5.0, on_swap=None):
+        self.root = root
+        self.loader = loader
+        self.poll_interval = poll_interval
+        self.on_swap = on_swap
+        self._generation = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.failed_version = None
+        self.last_error = None
+
+    def current(self):
+        return self._generation
+
+    def load(self, version=None):
+        version = version or current_version(self.root)
+        start = time.time()
+        artifacts = self.loader(version)
+        generation = Generation(
+            version, start, time.time() - start, **artifacts
+        )
+        with self._lock:
+            self._generation = generation
+        print("[REGISTRY] serving version {}".format(version))
+        if self.on_swap is not None:
+            self.on_swap(generation)
+        return generation
+
+    def check(self):
+        # load the version named by CURRENT if it is new, returning whether
+        # a swap happened
+        try:
+            version = current_version(self.root)
+        except OSError as e:
+            self.last_error = repr(e)
+            return False
+
+        generation = self._generation
+        if generation is not None and version == generation.version:
+            return False
+        if version == self.failed_version:
+            return False
+        try:
+            self.load(version)
+        except Exception as e:
+            self.failed_version = version
+            self.last_error = repr(e)
+            traceback.print_exc()
+            return False
+        self.failed_version = None
+        self.last_error = None
+        return True
+
+    def start(self):
+        # watch CURRENT from a daemon thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="artifact-registry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.check()
+
+    def status(self):
+        generation = self._generation
+        return {
+            "version": generation.version if generation else None,
+            "loaded_at": (
+                time.strftime(
+                    "%Y-%m-%d %H:%M:%S +0000",
+                    time.gmtime(generation.loaded_at),
+                )
+                if generation
+                else None
+            ),
+            "load_seconds": generation.load_seconds if generation else None,
+            "failed_version": self.failed_version,
+            "last_error": self.last_error,
+        }
@@ -1,7 +1,10 @@
 #!/bin/bash
 
 export PYTHONPATH=${PROJECT_HOME}/personalized_hackernews
+# serving bundle exported by train.py
+export BUNDLE_DIR=${BUNDLE_DIR:-${PYTHONPATH}/bundle}
 
 echo $PYTHONPATH
-flask run
+# pre-fork worker pool, see serve.py for WORKERS/THREADS/BIND
+python3 serve.py
 #python3 app.py
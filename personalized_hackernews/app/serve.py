@@ -0,0 +1,55 @@
+# production entry point: a pre-fork gunicorn worker pool serving app.py.
+#
+# The app and its bundle registry, with the current bundle loaded, are
+# imported once in the master before forking, so workers share that memory
+# copy-on-write; the bundle arrays are memory mapped and shared through the
+# page cache on top of that. Every worker opens its own MongoClient and
+# watches for new bundles on its own thread.
+#
+# configure with environment variables:
+#   BIND     address to listen on (default 0.0.0.0:5000)
+#   WORKERS  number of worker processes (default: number of cpus)
+#   THREADS  request threads per worker (default 4)
+#   TIMEOUT  seconds before a silent worker is restarted (default 60)
+from gunicorn.app.base import BaseApplication
+
+import multiprocessing
+import os
+
+
+def post_fork(server, worker):
+    import app
+
+    # threads do not survive fork, restart the artifact watcher per worker
+    app.registry.start()
+
+
+class HNApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super(HNApplication, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+
+        return app
+
+
+def get_options():
+    return {
+        "bind": os.environ.get("BIND", "0.0.0.0:5000"),
+        "workers": int(os.environ.get("WORKERS", multiprocessing.cpu_count())),
+        "threads": int(os.environ.get("THREADS", 4)),
+        "worker_class": "gthread",
+        "timeout": int(os.environ.get("TIMEOUT", 60)),
+        "preload_app": True,
+        "post_fork": post_fork,
+    }
+
+
+if __name__ == "__main__":
+    HNApplication(get_options()).run()
@@ -0,0 +1,385 @@
+# benchmarks of the hot paths of scraping, training and serving on a
+# synthetic corpus (see benchmarks.synthetic), at every corpus size given.
+# Run from personalized_hackernews/ with
+# `python -m benchmarks.bench_hot_paths [--sizes 100 1000] [--output
+# results.json] [--compare baseline.json]`; with --compare, exits 1 if a
+# benchmark got slower than the baseline by more than --threshold.
+# Benchmarks whose dependencies (bs4, scrapy, mongomock) are missing are
+# skipped.
+from benchmarks.synthetic import SyntheticCorpus
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "app")
+PGRAPH_LEN_THRES = 30  # as in scraping.spider.configs
+PGRAPH_ROLLING_WINDOW = 5
+MODEL_TRAIN_DOCS = 500  # docs the fixture Doc2Vec model is trained on
+NUM_CLUSTERS = 30
+NUM_QUERIES = 200  # queries per run of the serving benchmarks
+API_BATCH_SIZE = 50  # queries per /api/query request
+SLOWDOWN_THRESHOLD = 0.2  # relative slowdown flagged by --compare
+
+# fixtures shared by benchmarks and sizes: the Doc2Vec model, the bundle
+# directory and the imported app module
+_fixtures = {}
+
+
+def doc2vec_model(corpus):
+    if "model" not in _fixtures:
+        from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+
+        _fixtures["model"] = Doc2Vec(
+            [
+                TaggedDocument(corpus.tokens(doc), [row])
+                for row, doc in enumerate(corpus.docs(MODEL_TRAIN_DOCS))
+            ],
+            vector_size=50,
+            window=8,
+            min_count=1,
+            workers=1,
+            epochs=5,
+            seed=0,
+        )
+    return _fixtures["model"]
+
+
+def load_app(root, version, docs=()):
+    # app module serving `version` of the bundle directory root, with a
+    # mongomock collection holding docs in place of Mongo. The app is
+    # imported once per process, so root must not change between calls.
+    import mongomock
+
+    if "app" not in _fixtures:
+        os.environ["BUNDLE_DIR"] = root
+        sys.path.insert(0, APP_DIR)
+        import app
+
+        # the app resolves its templates from the working directory
+        app.app.root_path = APP_DIR
+        _fixtures["app"] = app
+    app = _fixtures["app"]
+    app.registry.load(version)
+
+    client = mongomock.MongoClient()
+    if docs:
+        client.hndb["filtered_hn_sites"].insert_many(docs)
+    app._mongo.update(pid=os.getpid(), client=client)
+    return app
+
+
+def serving_app(corpus, size):
+    # app module serving a bundle of `size` synthetic docs
+    import numpy as np
+    from sklearn.cluster import KMeans
+    from train.bundle import (
+        save_inference_model,
+        set_current_version,
+        write_bundle,
+    )
+    from train.keyword_index import KeywordIndex
+    from train.metadata import MetadataStore
+
+    if "bundle_dir" not in _fixtures:
+        _fixtures["bundle_dir"] = tempfile.mkdtemp(prefix="bench_bundle_")
+    root = _fixtures["bundle_dir"]
+    version = "bench-{}".format(size)
+    docs = list(corpus.docs(size))
+    if not os.path.exists(os.path.join(root, version)):
+        model = doc2vec_model(corpus)
+        vectors = corpus.vectors(size, vector_size=model.vector_size)
+        kmeans = KMeans(
+            n_clusters=min(NUM_CLUSTERS, size), n_init=1, random_state=0
+        ).fit(vectors)
+        write_bundle(
+            root,
+            kmeans.cluster_centers_,
+            kmeans.labels_,
+            np.zeros(model.vector_size),
+            np.ones(model.vector_size),
+            vectors,
+            [str(doc["_id"]) for doc in docs],
+            KeywordIndex.build(corpus.tokens(doc) for doc in docs),
+            MetadataStore.build(docs),
+            lambda path: save_inference_model(model, path),
+            version=version,
+            make_current=False,
+        )
+    set_current_version(root, version)
+    return load_app(root, version, docs)
+
+
+def remove_fixtures():
+    # delete the synthetic bundles written by serving_app
+    if "bundle_dir" in _fixtures:
+        shutil.rmtree(_fixtures.pop("bundle_dir"))
+
+
+def queries(corpus, num_queries, seed=0):
+    # comma-separated search keywords, one to three per query
+    rng = random.Random(seed)
+    return [
+        ", ".join(corpus.keywords(rng, rng.randint(1, 3)))
+        for _ in range(num_queries)
+    ]
+
+
+# every benchmark takes the corpus and a size and returns (run, num_items):
+# the function to time and the number of items one call of it processes
+
+
+def bench_parse_paragraphs(corpus, size):
+    from bs4 import BeautifulSoup
+    from scraping.scrape import parse_paragraphs
+
+    pgraph_lists = [
+        BeautifulSoup(corpus.html(doc), "html.parser").find_all("p")
+        for doc in corpus.docs(size)
+    ]
+
+    def run():
+        for pgraphs in pgraph_lists:
+            parse_paragraphs(pgraphs, PGRAPH_LEN_THRES, PGRAPH_ROLLING_WINDOW)
+
+    return run, len(pgraph_lists)
+
+
+def bench_parse_site(corpus, size):
+    from scrapy.http import HtmlResponse
+    from scraping.spider import HNSpider
+
+    spider = HNSpider()
+    responses = [
+        HtmlResponse(
+            url=doc["href"][0], body=corpus.html(doc), encoding="utf-8"
+        )
+        for doc in corpus.docs(size)
+    ]
+
+    def run():
+        for response in responses:
+            spider.parse_site(response)
+
+    return run, len(responses)
+
+
+def bench_pipeline_transform(corpus, size):
+    from train.train import (
+        pgraph_pipeline,
+        title_pipeline,
+        transform_instance,
+    )
+
+    docs = list(corpus.docs(size))
+
+    def run():
+        for doc in docs:
+            transform_instance(doc, title_pipeline, pgraph_pipeline)
+
+    return run, len(docs)
+
+
+def bench_infer_vector(corpus, size):
+    from train.inference import infer_vector
+
+    model = doc2vec_model(corpus)
+    token_lists = [corpus.tokens(doc) for doc in corpus.docs(size)]
+
+    def run():
+        for row, words in enumerate(token_lists):
+            infer_vector(model, words, seed=row)
+
+    return run, len(token_lists)
+
+
+def bench_pick_samples_of_label(corpus, size):
+    app = serving_app(corpus, size)
+    bundle = app.registry.current().bundle
+    rows = random.Random(0).choices(range(size), k=NUM_QUERIES)
+    vectors = bundle.vectors(rows)
+    labels = bundle.predict(vectors)
+
+    def run():
+        app.pick_samples_of_label(
+            bundle.index, labels, vectors, top=app.QUERY_DEFAULT_TOP
+        )
+
+    return run, len(rows)
+
+
+def bench_query_endpoint(corpus, size):
+    # uncached /query requests, rendered
+    app = serving_app(corpus, size)
+    client = app.app.test_client()
+    keywords = queries(corpus, NUM_QUERIES)
+
+    def run():
+        app.query_cache.clear()
+        for query in keywords:
+            response = client.get("/query", query_string={"keywords": query})
+            assert response.status_code == 200, response.status
+            response.get_data()
+
+    return run, len(keywords)
+
+
+def bench_api_query_fields(corpus, size):
+    # uncached batched /api/query requests, fetching paragraphs from Mongo
+    app = serving_app(corpus, size)
+    client = app.app.test_client()
+    keywords = queries(corpus, NUM_QUERIES)
+    batches = [
+        keywords[start : start + API_BATCH_SIZE]
+        for start in range(0, len(keywords), API_BATCH_SIZE)
+    ]
+
+    def run():
+        app.query_cache.clear()
+        for batch in batches:
+            response = client.post(
+                "/api/query",
+                json={"queries": batch, "top": 10, "fields": ["paragraphs"]},
+            )
+            assert response.status_code == 200, response.status
+
+    return run, len(keywords)
+
+
+BENCHMARKS = {
+    "parse_paragraphs": bench_parse_paragraphs,
+    "parse_site": bench_parse_site,
+    "pipeline_transform": bench_pipeline_transform,
+    "infer_vector": bench_infer_vector,
+    "pick_samples_of_label": bench_pick_samples_of_label,
+    "query_endpoint": bench_query_endpoint,
+    "api_query_fields": bench_api_query_fields,
+}
+
+
+def measure(run, repeat):
+    # seconds of `repeat` calls of run, after an untimed warm up call
+    run()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_benchmarks(names, sizes, repeat, seed=0):
+    corpus = SyntheticCorpus(seed=seed)
+    results, skipped = [], {}
+    for name in names:
+        for size in sizes:
+            try:
+                run, num_items = BENCHMARKS[name](corpus, size)
+            except ImportError as e:
+                skipped[name] = "missing dependency: {}".format(e.name)
+                print("{:<24} skipped, {}".format(name, skipped[name]))
+                break
+            seconds = measure(run, repeat)
+            result = {
+                "benchmark": name,
+                "size": size,
+                "items": num_items,
+                "seconds": min(seconds),
+                "median_seconds": statistics.median(seconds),
+                "per_item_ms": 1e3 * min(seconds) / max(num_items, 1),
+            }
+            results.append(result)
+            print(
+                "{:<24} size {:>7} {:>9.3f}s {:>10.4f} ms/item".format(
+                    name, size, result["seconds"], result["per_item_ms"]
+                )
+            )
+    return results, skipped
+
+
+def compare(results, baseline, threshold=SLOWDOWN_THRESHOLD):
+    # (benchmark, size, baseline ms/item, ms/item, ratio) of the results
+    # also in baseline, and those slower than it by more than threshold
+    previous = {
+        (result["benchmark"], result["size"]): result["per_item_ms"]
+        for result in baseline["results"]
+    }
+    rows, slowdowns = [], []
+    for result in results:
+        key = (result["benchmark"], result["size"])
+        if key not in previous:
+            continue
+        ratio = result["per_item_ms"] / max(previous[key], 1e-12)
+        row = key + (previous[key], result["per_item_ms"], ratio)
+        rows.append(row)
+        if ratio > 1 + threshold:
+            slowdowns.append(row)
+    return rows, slowdowns
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="hot path benchmarks on a synthetic corpus"
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS),
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--compare", help="baseline results json file")
+    parser.add_argument("--threshold", type=float, default=SLOWDOWN_THRESHOLD)
+    args = parser.parse_args()
+
+    try:
+        results, skipped = run_benchmarks(
+            args.benchmarks, args.sizes, args.repeat, seed=args.seed
+        )
+    finally:
+        remove_fixtures()
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S +0000", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+        "skipped": skipped,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("results in {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, slowdowns = compare(results, baseline, args.threshold)
+        print(
+            "{:<24} {:>7} {:>12} {:>12} {:>7}".format(
+                "benchmark", "size", "baseline ms", "ms/item", "ratio"
+            )
+        )
+        for row in rows:
+            print(
+                "{:<24} {:>7} {:>12.4f} {:>12.4f} {:>6.2f}x{}".format(
+                    *row, "  SLOWER" if row in slowdowns else ""
+                )
+            )
+        if slowdowns:
+            print(
+                "{} benchmarks slower than the baseline by more than "
+                "{:.0%}".format(len(slowdowns), args.threshold)
+            )
+            sys.exit(1)
@@ -0,0 +1,105 @@
+# times the tokenizer backends of train.tokenizers on a fixture corpus;
+# tests/test_tokenizers.py checks that they produce the same tokens.
+# Run from personalized_hackernews/ with
+# `python -m benchmarks.bench_tokenizers [--docs docs.pkl]`.
+from train.tokenizers import RegexTokenizer, SimplePreprocessTokenizer
+
+import argparse
+import pickle
+import random
+import time
+
+# text that exercises the corners of simple_preprocess: digits inside
+# words, underscores, lengths around the 2..15 limits, non-latin scripts,
+# casing that changes under lower() and accents
+EDGE_CASES = [
+    "",
+    "a",
+    "ab",
+    "Hello, World!",
+    "abc123def 4you x86_64 _private __dunder__ snake_case_name",
+    "a" * 15 + " " + "b" * 16 + " " + "c" * 14,
+    "supercalifragilisticexpialidocious is long",
+    "Café naïve résumé Ærøskøbing Straße",
+    "ΣΊΣΥΦΟΣ Οδυσσεύς ΟΔΟΣ",
+    "İstanbul DİYARBAKIR ǅemal",
+    "Привет, мир! Москва-сити",
+    "東京 タワー and 北京",
+    "emoji 🚀 rocket 🦀 crab",
+    "tab\tseparated\nnew\nlines and\r\ncrlf",
+    "hyphen-ated, apostrophe's and dots.in.names",
+    "ﬁne ligatures and Ⅻ numerals",
+    "x_ _x _ __ a_b 1_a a1_",
+]
+
+WORDS = (
+    "rust async Kernel GPU cuda naïve Zürich data x86 _init über ΣΟΦΙΑ "
+    "tokenization a I mmap Python3 the of and LLM embedding déjà vu "
+    "internationalization snake_case 42 3.14 C++ Go"
+).split()
+
+
+def fixture_corpus(num_docs=2000, seed=0):
+    # list of documents, each a list of paragraphs
+    rng = random.Random(seed)
+    docs = [EDGE_CASES]
+    for _ in range(num_docs):
+        docs.append(
+            [
+                " ".join(
+                    rng.choice(WORDS) + rng.choice(["", "", ",", ".", "!"])
+                    for _ in range(rng.randint(0, 120))
+                )
+                for _ in range(rng.randint(1, 8))
+            ]
+        )
+    return docs
+
+
+def load_docs(path):
+    # paragraphs of pickled scraped documents, titles included
+    with open(path, "rb") as f:
+        docs = pickle.load(f)
+    corpus = []
+    for doc in docs:
+        titles = doc.get("title", [])
+        if not isinstance(titles, list):
+            titles = [titles]
+        corpus.append(
+            titles + doc.get("subtitles", []) + doc.get("paragraphs", [])
+        )
+    return corpus
+
+
+def time_backend(tokenizer, corpus, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for doc in corpus:
+            tokenizer.tokenize_joined(doc)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="tokenizer backend throughput"
+    )
+    parser.add_argument("--docs", help="pickled list of scraped documents")
+    parser.add_argument("--num-docs", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = (
+        load_docs(args.docs) if args.docs else fixture_corpus(args.num_docs)
+    )
+    backends = [SimplePreprocessTokenizer(), RegexTokenizer()]
+
+    num_chars = sum(len(text) for doc in corpus for text in doc)
+    for backend in backends:
+        seconds = time_backend(backend, corpus, args.repeat)
+        print(
+            "{:<20} {:8.3f}s {:8.1f}M chars/s".format(
+                backend.name, seconds, num_chars / seconds / 1e6
+            )
+        )
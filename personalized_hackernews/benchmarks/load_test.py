@@ -0,0 +1,316 @@
+# closed-loop load test of the app: `--users` concurrent users each send a
+# request, wait for the response and send the next one, to "/" or to
+# "/query" with Zipf-distributed keywords from the served vocabulary,
+# optionally paced to `--rate` requests per second overall. Reports
+# throughput, latency percentiles and error rate per endpoint.
+# Run from personalized_hackernews/ with
+# `python -m benchmarks.load_test [--url http://host:5000 --bundle DIR]`.
+# Without --url, a local instance is started in this process on a bundle
+# (--bundle, or a synthetic one of --num-docs docs) with mongomock in place
+# of Mongo; it shares the GIL with the users, so size deployments against
+# serve.py with --url.
+from benchmarks.bench_hot_paths import load_app, remove_fixtures, serving_app
+from benchmarks.synthetic import SyntheticCorpus
+from collections import Counter, defaultdict
+from train.bundle import KEYWORD_INDEX_DIR, current_version
+from train.keyword_index import KeywordIndex
+from urllib.parse import urlencode, urlsplit
+
+import argparse
+import http.client
+import json
+import logging
+import numpy as np
+import os
+import random
+import threading
+import time
+
+ZIPF_EXPONENT = 1.0
+MAX_KEYWORDS = 3  # keywords per query, uniform in 1..MAX_KEYWORDS
+INDEX_SHARE = 0.1  # share of requests to "/"; the rest go to "/query"
+REQUEST_TIMEOUT = 30  # seconds
+PERCENTILES = [50, 95, 99]
+
+
+def vocabulary_by_frequency(keyword_index):
+    # terms of a KeywordIndex, those in the most documents first
+    doc_freqs = np.diff(keyword_index.offsets)
+    order = np.argsort(-doc_freqs, kind="stable")
+    return keyword_index.terms[order].tolist()
+
+
+class KeywordWorkload:
+    """
+    Search queries of 1 to max_keywords keywords, each drawn from
+    `vocabulary` (most frequent first) with probability proportional to
+    1 / rank ** exponent, so popular searches repeat like in real traffic.
+    """
+
+    def __init__(
+        self, vocabulary, exponent=ZIPF_EXPONENT, max_keywords=MAX_KEYWORDS
+    ):
+        self.vocabulary = vocabulary
+        self.max_keywords = max_keywords
+        weights = 1 / np.arange(1, len(vocabulary) + 1) ** exponent
+        self.cum_weights = np.cumsum(weights).tolist()
+
+    def query(self, rng):
+        return ", ".join(
+            rng.choices(
+                self.vocabulary,
+                cum_weights=self.cum_weights,
+                k=rng.randint(1, self.max_keywords),
+            )
+        )
+
+
+class Pacer:
+    # hands out request start times `1 / rate` apart across all users; a
+    # rate of 0 does not pace
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            start = max(self.next_start, time.perf_counter())
+            self.next_start = start + self.interval
+        delay = start - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class User(threading.Thread):
+    # sends requests over one keep-alive connection until `deadline`,
+    # recording (endpoint, start, seconds, status) of every request; the
+    # status is None when the request failed without a response
+    def __init__(self, host, port, workload, pacer, deadline, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self.host = host
+        self.port = port
+        self.workload = workload
+        self.pacer = pacer
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.records = []
+        self.connection = None
+
+    def request(self, path):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=REQUEST_TIMEOUT
+            )
+        try:
+            self.connection.request("GET", path)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None
+
+    def run(self):
+        while True:
+            self.pacer.wait()
+            start = time.perf_counter()
+            if start >= self.deadline:
+                break
+            if self.rng.random() < INDEX_SHARE:
+                endpoint, path = "/", "/"
+            else:
+                endpoint = "/query"
+                path = "/query?" + urlencode(
+                    {"keywords": self.workload.query(self.rng)}
+                )
+            status = self.request(path)
+            self.records.append(
+                (endpoint, start, time.perf_counter() - start, status)
+            )
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_load(host, port, workload, users, duration, rate=0, warmup=0):
+    # records of every request started after `warmup` seconds, and the
+    # seconds they were sent over
+    start = time.perf_counter()
+    deadline = start + warmup + duration
+    pacer = Pacer(rate)
+    threads = [
+        User(host, port, workload, pacer, deadline, seed=i)
+        for i in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    measured_from = start + warmup
+    records = [
+        record
+        for thread in threads
+        for record in thread.records
+        if record[1] >= measured_from
+    ]
+    return records, duration
+
+
+def summarize(records, seconds):
+    # throughput, latency percentiles and errors per endpoint, and overall
+    by_endpoint = defaultdict(list)
+    for record in records:
+        by_endpoint[record[0]].append(record)
+    groups = sorted(by_endpoint.items())
+    if records:
+        groups.append(("all", records))
+    summary = {}
+    for endpoint, endpoint_records in groups:
+        latencies = np.array([record[2] for record in endpoint_records])
+        statuses = Counter(
+            "error" if record[3] is None else str(record[3])
+            for record in endpoint_records
+        )
+        errors = sum(
+            1
+            for record in endpoint_records
+            if record[3] is None or record[3] >= 400
+        )
+        summary[endpoint] = dict(
+            {
+                "requests": len(endpoint_records),
+                "throughput": len(endpoint_records) / seconds,
+                "error_rate": errors / len(endpoint_records),
+                "mean_ms": 1e3 * float(latencies.mean()),
+                "max_ms": 1e3 * float(latencies.max()),
+                "statuses": dict(statuses),
+            },
+            **{
+                "p{}_ms".format(q): 1e3 * float(np.percentile(latencies, q))
+                for q in PERCENTILES
+            }
+        )
+    return summary
+
+
+def print_summary(summary):
+    print(
+        "{:<8} {:>9} {:>9} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+            "endpoint",
+            "requests",
+            "req/s",
+            "errors",
+            "mean ms",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+        )
+    )
+    for endpoint, stats in summary.items():
+        print(
+            "{:<8} {:>9} {:>9.1f} {:>8.2%} {:>9.2f} {:>9.2f} {:>9.2f} "
+            "{:>9.2f}".format(
+                endpoint,
+                stats["requests"],
+                stats["throughput"],
+                stats["error_rate"],
+                stats["mean_ms"],
+                stats["p50_ms"],
+                stats["p95_ms"],
+                stats["p99_ms"],
+            )
+        )
+
+
+def start_local_server(app):
+    # serve the app from a background thread on a free local port
+    from werkzeug.serving import make_server
+
+    # no access log line per request
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="closed-loop app load test")
+    parser.add_argument("--url", help="running app, e.g. http://host:5000")
+    parser.add_argument(
+        "--bundle", help="bundle directory served, for the vocabulary"
+    )
+    parser.add_argument(
+        "--num-docs",
+        type=int,
+        default=10000,
+        help="docs of the synthetic bundle served without --bundle",
+    )
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="requests/s, 0 for no limit"
+    )
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--zipf", type=float, default=ZIPF_EXPONENT)
+    parser.add_argument("--output", help="write the summary to a json file")
+    args = parser.parse_args()
+
+    server = None
+    try:
+        if args.bundle:
+            version = current_version(args.bundle)
+            if args.url:
+                keyword_index = KeywordIndex.load(
+                    os.path.join(args.bundle, version, KEYWORD_INDEX_DIR)
+                )
+            else:
+                app = load_app(args.bundle, version)
+                keyword_index = app.registry.current().bundle.keyword_index
+        elif args.url:
+            parser.error("--url needs the --bundle it serves")
+        else:
+            print("building a synthetic bundle...")
+            app = serving_app(SyntheticCorpus(), args.num_docs)
+            keyword_index = app.registry.current().bundle.keyword_index
+
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            server = start_local_server(app)
+            host, port = "127.0.0.1", server.server_port
+
+        workload = KeywordWorkload(
+            vocabulary_by_frequency(keyword_index), exponent=args.zipf
+        )
+        print(
+            "{} users for {}s against {}:{}...".format(
+                args.users, args.duration, host, port
+            )
+        )
+        records, seconds = run_load(
+            host,
+            port,
+            workload,
+            args.users,
+            args.duration,
+            rate=args.rate,
+            warmup=args.warmup,
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+        remove_fixtures()
+
+    summary = summarize(records, seconds)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"config": vars(args), "endpoints": summary}, f, indent=2
+            )
+        print("summary in {}".format(args.output))
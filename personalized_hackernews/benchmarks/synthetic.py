@@ -0,0 +1,154 @@
+# deterministic synthetic data for benchmarks: crawled documents shaped like
+# the entries of mongo_sites_2, the HTML pages they could have been scraped
+# from, and clustered document vectors
+from bson import ObjectId
+from html import escape
+from itertools import accumulate
+
+import numpy as np
+import random
+import string
+
+VOCABULARY_SIZE = 20000
+NUM_TOPICS = 20
+NUM_DOMAINS = 500
+NUM_PARAGRAPHS = (5, 30)  # per document, inclusive range
+PARAGRAPH_WORDS = (10, 120)
+SHORT_PARAGRAPH_RATE = 0.2  # captions and bylines among the paragraphs
+LIST_RATE = 0.1  # bullet lists between paragraphs of the HTML pages
+INSERTION_TIME = "2023 Jan 01 00:00:00 +0000"
+
+
+def make_vocabulary(size=VOCABULARY_SIZE, seed=0):
+    # distinct lowercase words of 3 to 12 letters, which every tokenizer
+    # backend keeps as they are
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(
+            "".join(
+                rng.choice(string.ascii_lowercase)
+                for _ in range(rng.randint(3, 12))
+            )
+        )
+    return sorted(words)
+
+
+class SyntheticCorpus:
+    """
+    Documents whose words are drawn from a Zipf distribution over the
+    vocabulary, ranked differently for each of `num_topics` topics, so
+    documents of a topic share their frequent words. Everything is derived
+    from `seed`: docs(n) is a prefix of docs(m) for n < m, so runs at
+    different sizes see the same documents.
+    """
+
+    def __init__(
+        self, vocabulary_size=VOCABULARY_SIZE, num_topics=NUM_TOPICS, seed=0
+    ):
+        self.seed = seed
+        self.vocabulary = make_vocabulary(vocabulary_size, seed)
+        rng = random.Random(seed)
+        self.topics = [
+            rng.sample(self.vocabulary, len(self.vocabulary))
+            for _ in range(num_topics)
+        ]
+        # zipf with exponent 1: the word of rank r has weight 1 / r
+        self.cum_weights = list(
+            accumulate(1 / rank for rank in range(1, vocabulary_size + 1))
+        )
+        self.domains = [
+            "site{}.example.com".format(i) for i in range(NUM_DOMAINS)
+        ]
+
+    def words(self, rng, topic, num_words):
+        return rng.choices(
+            self.topics[topic], cum_weights=self.cum_weights, k=num_words
+        )
+
+    def doc(self, rng, i):
+        topic = rng.randrange(len(self.topics))
+        paragraphs = []
+        for _ in range(rng.randint(*NUM_PARAGRAPHS)):
+            if rng.random() < SHORT_PARAGRAPH_RATE:
+                num_words = rng.randint(1, 8)
+            else:
+                num_words = rng.randint(*PARAGRAPH_WORDS)
+            paragraphs.append(" ".join(self.words(rng, topic, num_words)))
+        domain = self.domains[
+            min(int(rng.paretovariate(1)) - 1, NUM_DOMAINS - 1)
+        ]
+        return {
+            "_id": ObjectId("{:024x}".format(i + 1)),
+            "title": [" ".join(self.words(rng, topic, rng.randint(3, 12)))],
+            "subtitles": [
+                " ".join(self.words(rng, topic, rng.randint(2, 6)))
+                for _ in range(rng.randint(0, 4))
+            ],
+            "paragraphs": paragraphs,
+            "href": ["https://{}/post/{}".format(domain, i)],
+            "relevantHrefs": [
+                "https://{}/".format(rng.choice(self.domains))
+                for _ in range(rng.randint(0, 20))
+            ],
+            "insertion_time": [INSERTION_TIME],
+            "last_update_time": [INSERTION_TIME],
+        }
+
+    def docs(self, num_docs):
+        rng = random.Random(self.seed + 1)
+        for i in range(num_docs):
+            yield self.doc(rng, i)
+
+    def tokens(self, doc):
+        # what the training pipelines tokenize doc to, before word limits
+        return " ".join(
+            doc["title"] + doc["subtitles"] + doc["paragraphs"]
+        ).split()
+
+    def html(self, doc):
+        # page doc could have been scraped from: title, headings, paragraphs
+        # interleaved with bullet lists, navigation and footer
+        rng = random.Random(doc["_id"].binary)
+        title = escape(doc["title"][0])
+        parts = [
+            "<html><head><title>{}</title></head><body>".format(title),
+            "<nav>{}</nav>".format(
+                "".join(
+                    '<a href="{0}">{0}</a>'.format(href)
+                    for href in doc["relevantHrefs"]
+                )
+            ),
+            "<h1>{}</h1>".format(title),
+        ]
+        parts += ["<h2>{}</h2>".format(escape(s)) for s in doc["subtitles"]]
+        for paragraph in doc["paragraphs"]:
+            parts.append("<p>{}</p>".format(escape(paragraph)))
+            if rng.random() < LIST_RATE:
+                items = paragraph.split()[:5]
+                parts.append(
+                    "<ul>{}</ul>".format(
+                        "".join("<li>{}</li>".format(w) for w in items)
+                    )
+                )
+        parts.append(
+            "<footer><p>copyright</p><time>{}</time></footer>"
+            "</body></html>".format(doc["insertion_time"][0])
+        )
+        return "\n".join(parts)
+
+    def vectors(self, num_docs, vector_size=50, num_clusters=30):
+        # float32 vectors in [0, 1] around num_clusters centers, like
+        # standardized Doc2Vec vectors
+        rng = np.random.default_rng(self.seed)
+        centers = rng.uniform(0.2, 0.8, size=(num_clusters, vector_size))
+        labels = rng.integers(num_clusters, size=num_docs)
+        vectors = centers[labels] + rng.normal(
+            scale=0.05, size=(num_docs, vector_size)
+        )
+        return np.clip(vectors, 0, 1).astype(np.float32)
+
+    def keywords(self, rng, num_keywords):
+        # search keywords, frequent words of a random topic most often
+        topic = rng.randrange(len(self.topics))
+        return self.words(rng, topic, num_keywords)
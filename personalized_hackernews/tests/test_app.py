@@ -0,0 +1,51 @@
+# the app serving a small synthetic bundle, with mongomock in place of Mongo
+from benchmarks.bench_hot_paths import remove_fixtures, serving_app
+from benchmarks.synthetic import SyntheticCorpus
+
+import pytest
+import random
+
+NUM_DOCS = 200
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return SyntheticCorpus()
+
+
+@pytest.fixture(scope="module")
+def app(corpus):
+    yield serving_app(corpus, NUM_DOCS)
+    remove_fixtures()
+
+
+def api_results(app, queries, **body):
+    response = app.app.test_client().post(
+        "/api/query", json=dict(body, queries=queries)
+    )
+    assert response.status_code == 200, response.get_json()
+    return [result["doc_ids"] for result in response.get_json()["results"]]
+
+
+def test_repeated_and_reordered_keywords_rank_the_same(app, corpus):
+    rng = random.Random(0)
+    for _ in range(50):
+        first, second = corpus.keywords(rng, 2)
+        queries = [
+            "{0}, {0}, {1}".format(first, second),
+            "{1}, {0}".format(first, second),
+        ]
+        uncached = []
+        for query in queries:
+            app.query_cache.clear()
+            uncached += api_results(app, [query])
+        assert uncached[0] == uncached[1], queries
+        assert api_results(app, queries) == uncached
+
+
+@pytest.mark.parametrize("top", [0, -1, "10", 1.5, True, False])
+def test_api_query_rejects_invalid_top(app, top):
+    response = app.app.test_client().post(
+        "/api/query", json={"queries": ["rust"], "top": top}
+    )
+    assert response.status_code == 400
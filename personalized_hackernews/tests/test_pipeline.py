@@ -0,0 +1,63 @@
+# compiled pipelines must transform like the processors run one by one
+from train.instrumentation import PipelineStats
+from train.train import (
+    DataPipeline,
+    ExcludeSitePreProcessor,
+    FlattenProcessor,
+    GenSimProcessor,
+    Processor,
+    WordCountLimitProcessor,
+)
+
+import pytest
+
+DOCS = [
+    {"href": ["https://kept.example.com/"], "title": ["kept"]},
+    {"href": ["https://excluded.example.com/"], "title": ["excluded"]},
+]
+PARAGRAPHS = [
+    ["Rust async runtimes", "a", "Kernel bypass networking with io_uring"],
+    ["too short"],
+    [],
+]
+
+
+class SortProcessor(Processor):
+    # list to list processor without stream()
+    def transform(self, words, DEBUG=False):
+        return sorted(words)
+
+
+def exclude_site_pipeline():
+    pipeline = DataPipeline()
+    pipeline.register_postprocessor(
+        ExcludeSitePreProcessor(
+            "exclude_site_preprocessor", ["https://excluded.example.com/"]
+        ),
+        10,
+    )
+    return pipeline
+
+
+def tokenizing_pipeline():
+    pipeline = DataPipeline()
+    pipeline.register_postprocessor(GenSimProcessor("gensim"), 30)
+    pipeline.register_postprocessor(FlattenProcessor("flatten"), 60)
+    pipeline.register_postprocessor(SortProcessor("sort"), 65)
+    pipeline.register_postprocessor(WordCountLimitProcessor("limit", 3), 70)
+    return pipeline
+
+
+@pytest.mark.parametrize(
+    "make_pipeline, inputs",
+    [(exclude_site_pipeline, DOCS), (tokenizing_pipeline, PARAGRAPHS)],
+)
+@pytest.mark.parametrize("per_stage", [None, False, True])
+def test_compiled_matches_uncompiled(make_pipeline, inputs, per_stage):
+    expected = [make_pipeline().transform(data) for data in inputs]
+    assert None in expected  # the abort case is covered
+
+    pipeline = make_pipeline().compile()
+    if per_stage is not None:
+        pipeline.instrument(PipelineStats(), per_stage=per_stage)
+    assert [pipeline.transform(data) for data in inputs] == expected
@@ -0,0 +1,38 @@
+# every tokenizer backend must produce the tokens of simple_preprocess, the
+# reference the Doc2Vec models were trained with
+from benchmarks.bench_tokenizers import EDGE_CASES, fixture_corpus
+from train.tokenizers import TOKENIZERS, SimplePreprocessTokenizer
+
+import pytest
+
+REFERENCE = SimplePreprocessTokenizer.name
+CANDIDATES = [name for name in TOKENIZERS if name != REFERENCE]
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return fixture_corpus()
+
+
+@pytest.mark.parametrize("name", CANDIDATES)
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_edge_case_parity(name, text):
+    reference, candidate = TOKENIZERS[REFERENCE](), TOKENIZERS[name]()
+    assert candidate.tokenize(text) == reference.tokenize(text)
+
+
+@pytest.mark.parametrize("name", CANDIDATES)
+def test_edge_cases_joined_parity(name):
+    reference, candidate = TOKENIZERS[REFERENCE](), TOKENIZERS[name]()
+    assert candidate.tokenize_joined(EDGE_CASES) == reference.tokenize_joined(
+        EDGE_CASES
+    )
+
+
+@pytest.mark.parametrize("name", CANDIDATES)
+def test_fixture_corpus_parity(name, corpus):
+    reference, candidate = TOKENIZERS[REFERENCE](), TOKENIZERS[name]()
+    for doc in corpus:
+        for text in doc:
+            assert candidate.tokenize(text) == reference.tokenize(text)
+        assert candidate.tokenize_joined(doc) == reference.tokenize_joined(doc)
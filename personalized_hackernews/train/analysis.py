@@ -0,0 +1,141 @@
+from matplotlib.figure import Figure
+from sklearn.decomposition import PCA
+
+import json
+import numpy as np
+import os
+
+PCA_SAMPLE_SIZE = 5000  # docs drawn in the PCA scatter plot
+
+
+def centroid_distances(centroids):
+    # euclidean distance between every pair of centroids
+    sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    sq_dists = sq_norms[:, None] - 2 * centroids @ centroids.T + sq_norms
+    np.fill_diagonal(sq_dists, 0)
+    return np.sqrt(np.maximum(sq_dists, 0))
+
+
+def length_stats(labels, doc_lens, n_clusters):
+    # count, mean, std, min, median and max document length per cluster
+    labels = np.asarray(labels)
+    doc_lens = np.asarray(doc_lens, dtype=np.float64)
+    counts = np.bincount(labels, minlength=n_clusters)
+    safe_counts = np.maximum(counts, 1)
+    mean = np.bincount(labels, weights=doc_lens, minlength=n_clusters)
+    mean /= safe_counts
+    sq_mean = np.bincount(labels, weights=doc_lens**2, minlength=n_clusters)
+    sq_mean /= safe_counts
+    std = np.sqrt(np.maximum(sq_mean - mean**2, 0))
+
+    # lengths sorted by cluster, then by length: every cluster is a
+    # contiguous sorted run, starting at `starts`
+    order = np.lexsort((doc_lens, labels))
+    sorted_lens = doc_lens[order]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    ends = starts + counts - 1
+    nonempty = counts > 0
+    lo = sorted_lens[(starts + (counts - 1) // 2)[nonempty]]
+    hi = sorted_lens[(starts + counts // 2)[nonempty]]
+
+    def per_cluster(values):
+        out = np.zeros(n_clusters)
+        out[nonempty] = values
+        return out
+
+    return {
+        "count": counts,
+        "mean": mean,
+        "std": std,
+        "min": per_cluster(sorted_lens[starts[nonempty]]),
+        "median": per_cluster((lo + hi) / 2),
+        "max": per_cluster(sorted_lens[ends[nonempty]]),
+    }
+
+
+def pca_projection(X, labels, sample_size=PCA_SAMPLE_SIZE, seed=0):
+    # 2d PCA projection of a random sample of X and the sample's labels
+    X = np.asarray(X)
+    rows = np.arange(len(X))
+    if sample_size is not None and sample_size < len(X):
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(len(X), sample_size, replace=False))
+    pca = PCA(n_components=2).fit(X[rows])
+    return pca.transform(X[rows]), np.asarray(labels)[rows], pca
+
+
+def _bar(path, values, title, ylabel):
+    fig = Figure()
+    ax = fig.subplots()
+    ax.bar(np.arange(len(values)), values)
+    ax.set_xlabel("label")
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    fig.savefig(path)
+
+
+def write_analysis(report_dir, centroids, labels, doc_lens, X=None):
+    """
+    Writes the post-training cluster analysis to report_dir: report.json
+    with the centroid distance matrix, the number of docs and document
+    length statistics per cluster, and a PNG per plot. With X, the
+    vectors the clusters were fitted on, a 2d PCA projection of them is
+    plotted too. Figures are drawn without pyplot, so no display is
+    needed.
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    centroids = np.asarray(centroids)
+    dists = centroid_distances(centroids)
+    lens = length_stats(labels, doc_lens, len(centroids))
+
+    report = {
+        "num_docs": int(len(labels)),
+        "num_clusters": len(centroids),
+        "centroid_distances": dists.tolist(),
+        "doc_len_by_label": {
+            name: values.tolist() for name, values in lens.items()
+        },
+    }
+
+    fig = Figure()
+    ax = fig.subplots()
+    image = ax.imshow(dists, cmap="hot", interpolation="nearest")
+    fig.colorbar(image)
+    ax.set_title("distance between centroids")
+    fig.savefig(os.path.join(report_dir, "centroid_distances.png"))
+
+    _bar(
+        os.path.join(report_dir, "count_by_label.png"),
+        lens["count"],
+        "count by label",
+        "documents",
+    )
+    _bar(
+        os.path.join(report_dir, "doc_len_by_label.png"),
+        lens["mean"],
+        "document length by label",
+        "mean tokens",
+    )
+
+    if X is not None:
+        projected, projected_labels, pca = pca_projection(X, labels)
+        report["pca_explained_variance_ratio"] = (
+            pca.explained_variance_ratio_.tolist()
+        )
+        fig = Figure()
+        ax = fig.subplots()
+        ax.scatter(
+            projected[:, 0],
+            projected[:, 1],
+            c=projected_labels,
+            cmap="tab20",
+            s=4,
+        )
+        ax.set_title(
+            "kmeans clustering, PCA of {} docs".format(len(projected))
+        )
+        fig.savefig(os.path.join(report_dir, "pca.png"))
+
+    with open(os.path.join(report_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
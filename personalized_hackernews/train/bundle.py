@@ -0,0 +1,267 @@
+from gensim.models.doc2vec import Doc2Vec
+from functools import cached_property
+from gensim.models.keyedvectors import KeyedVectors
+from time import gmtime, strftime
+from train.keyword_index import KeywordIndex
+from train.metadata import MetadataStore
+from train.vector_index import ClusterIndex
+
+import json
+import numpy as np
+import os
+import shutil
+
+# a bundle directory holds one subdirectory per version and a CURRENT file
+# naming the version the app should serve
+CURRENT_FILE = "CURRENT"
+MODEL_FILE = "doc2vec.model"
+INDEX_DIR = "index"
+METADATA_DIR = "metadata"
+KEYWORD_INDEX_DIR = "keyword_index"
+
+
+def new_version():
+    return strftime("%Y%m%d-%H%M%S", gmtime())
+
+
+def export_bundle(
+    root,
+    model,
+    kmeans,
+    scaler,
+    X_vectors,
+    doc_ids,
+    keyword_index,
+    metadata,
+    dropped_ids=(),
+    drift_baseline=None,
+    version=None,
+    make_current=True,
+):
+    # bundle of a full training run
+    return write_bundle(
+        root,
+        kmeans.cluster_centers_,
+        kmeans.labels_,
+        scaler.min_,
+        scaler.scale_,
+        X_vectors,
+        doc_ids,
+        keyword_index,
+        metadata,
+        lambda path: save_inference_model(model, path),
+        dropped_ids=dropped_ids,
+        drift_baseline=drift_baseline,
+        manifest={"num_trained_docs": len(kmeans.labels_)},
+        version=version,
+        make_current=make_current,
+    )
+
+
+def write_bundle(
+    root,
+    centroids,
+    labels,
+    scaler_min,
+    scaler_scale,
+    X_vectors,
+    doc_ids,
+    keyword_index,
+    metadata,
+    save_model,
+    dropped_ids=(),
+    drift_baseline=None,
+    manifest=None,
+    version=None,
+    make_current=True,
+):
+    # write everything the app needs to serve queries, and nothing it does
+    # not, into root/<version>. Arrays are stored as plain .npy files so the
+    # app can memory map them. save_model(path) writes the Doc2Vec model.
+    version = version or new_version()
+    path = os.path.join(root, version)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    labels = np.asarray(labels, dtype=np.int32)
+    index = ClusterIndex.build(centroids, labels, X_vectors)
+    index.save(os.path.join(tmp_path, INDEX_DIR))
+    np.save(os.path.join(tmp_path, "labels.npy"), labels)
+    np.save(
+        os.path.join(tmp_path, "scaler_min.npy"),
+        np.asarray(scaler_min, dtype=np.float32),
+    )
+    np.save(
+        os.path.join(tmp_path, "scaler_scale.npy"),
+        np.asarray(scaler_scale, dtype=np.float32),
+    )
+    doc_ids = np.asarray(doc_ids)
+    np.save(os.path.join(tmp_path, "doc_ids.npy"), doc_ids)
+    # ids of the docs preprocessing dropped, so updates do not retry them
+    np.save(
+        os.path.join(tmp_path, "dropped_ids.npy"),
+        np.asarray(dropped_ids, dtype=str),
+    )
+    # scaled vectors of training docs inferred but not fitted, that
+    # train.update compares the docs it adds with
+    if drift_baseline is None:
+        drift_baseline = np.empty((0, index.blocks.shape[1]))
+    np.save(
+        os.path.join(tmp_path, "drift_baseline.npy"),
+        np.asarray(drift_baseline, dtype=np.float32),
+    )
+    keyword_index.save(os.path.join(tmp_path, KEYWORD_INDEX_DIR))
+    metadata.save(os.path.join(tmp_path, METADATA_DIR))
+
+    save_model(os.path.join(tmp_path, MODEL_FILE))
+
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(
+            dict(
+                manifest or {},
+                version=version,
+                num_docs=len(labels),
+                num_clusters=len(centroids),
+                vector_size=index.blocks.shape[1],
+            ),
+            f,
+            indent=2,
+        )
+
+    os.rename(tmp_path, path)
+    if make_current:
+        set_current_version(root, version)
+    return path
+
+
+def link_model(src_path, path):
+    # reuse the saved model of another bundle; bundles are never modified,
+    # so its files are hard linked rather than copied where possible
+    src_dir, name = os.path.split(src_path)
+    for filename in os.listdir(src_dir):
+        if filename.startswith(name):
+            src = os.path.join(src_dir, filename)
+            dst = path + filename[len(name) :]
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+
+def save_inference_model(model, path):
+    # infer_vector only needs the word vectors and output weights; the
+    # trained doc vectors are already stored in the index. sep_limit=0
+    # stores every array in its own .npy file so it can be memory mapped.
+    trained_dv = model.dv
+    model.dv = KeyedVectors(model.vector_size, 0, dtype=np.float32)
+    try:
+        model.save(path, sep_limit=0)
+    finally:
+        model.dv = trained_dv
+
+
+def set_current_version(root, version):
+    # replace the pointer file atomically, so readers never see it empty
+    tmp_path = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def current_version(root):
+    with open(os.path.join(root, CURRENT_FILE)) as f:
+        return f.read().strip()
+
+
+def list_versions(root):
+    # complete versions of the bundle directory, oldest first
+    versions = [
+        name
+        for name in os.listdir(root)
+        if os.path.isfile(os.path.join(root, name, "manifest.json"))
+    ]
+    return sorted(
+        versions,
+        key=lambda name: (
+            os.path.getmtime(os.path.join(root, name, "manifest.json")),
+            name,
+        ),
+    )
+
+
+def prune_versions(root, keep):
+    # delete all but the `keep` newest versions and the current one; an app
+    # still serving an older version keeps its open files until it swaps.
+    # Models linked from another version are hard links or copies, so
+    # deleting that version leaves them intact. Returns the deleted versions.
+    current = current_version(root)
+    versions = list_versions(root)
+    deleted = [
+        version
+        for version in versions[: max(len(versions) - keep, 0)]
+        if version != current
+    ]
+    for version in deleted:
+        shutil.rmtree(os.path.join(root, version))
+    return deleted
+
+
+class ArtifactBundle:
+    """
+    Read-only view of an exported bundle. Arrays and the Doc2Vec weights
+    are memory mapped, so processes serving the same bundle share pages and
+    loading does not read the vectors into memory. Serving does not infer
+    vectors, so the Doc2Vec model is only loaded when `model` is first
+    used.
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest["version"]
+        self.index = ClusterIndex.load(
+            os.path.join(path, INDEX_DIR), mmap_mode=mmap_mode
+        )
+        self.labels = load("labels.npy")
+        self.scaler_min = load("scaler_min.npy")
+        self.scaler_scale = load("scaler_scale.npy")
+        self.doc_ids = load("doc_ids.npy")
+        self.dropped_ids = load("dropped_ids.npy")
+        self.drift_baseline = load("drift_baseline.npy")
+        self.keyword_index = KeywordIndex.load(
+            os.path.join(path, KEYWORD_INDEX_DIR), mmap_mode=mmap_mode
+        )
+        self.metadata = MetadataStore.load(
+            os.path.join(path, METADATA_DIR), mmap_mode=mmap_mode
+        )
+        self.model_path = os.path.join(path, MODEL_FILE)
+
+    @cached_property
+    def model(self):
+        return Doc2Vec.load(self.model_path, mmap=self.mmap_mode)
+
+    @property
+    def centroids(self):
+        return self.index.centroids
+
+    def scale(self, vectors):
+        # same as MinMaxScaler.transform
+        return np.atleast_2d(vectors) * self.scaler_scale + self.scaler_min
+
+    def predict(self, scaled_vectors):
+        return self.index.predict(scaled_vectors)
+
+    def vectors(self, rows):
+        return self.index.vectors(rows)
+
+
+def load_bundle(root, version=None, mmap_mode="r"):
+    version = version or current_version(root)
+    return ArtifactBundle(os.path.join(root, version), mmap_mode=mmap_mode)
@@ -0,0 +1,58 @@
+from gensim.models.doc2vec import TaggedDocument
+
+
+class LineCorpus:
+    """
+    Tokenized corpus stored one document per line, tokens separated by
+    spaces. This is the format gensim's `corpus_file` training reads (the
+    tag of a document is its line number, i.e. its X_vectors row), and
+    iterating it again re-reads the file, so it can also be passed to
+    Doc2Vec as a restartable stream without holding the corpus in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        for row, words in enumerate(self.iter_words()):
+            yield TaggedDocument(words, [row])
+
+    def iter_words(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                yield line.split()
+
+    def iter_rows(self, rows):
+        # words of the documents at sorted `rows`, in one pass over the file
+        rows = iter(rows)
+        wanted = next(rows, None)
+        for row, words in enumerate(self.iter_words()):
+            if wanted is None:
+                return
+            if row == wanted:
+                yield words
+                wanted = next(rows, None)
+
+
+class CorpusWriter:
+    # appends tokenized documents to a LineCorpus file
+    def __init__(self, path):
+        self.path = path
+        self.num_docs = 0
+        self.num_words = 0
+        self.doc_lens = []
+
+    def __enter__(self):
+        self.f = open(self.path, "w", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.f.close()
+
+    def write(self, words):
+        # tokens from simple_preprocess never contain whitespace
+        self.f.write(" ".join(words))
+        self.f.write("\n")
+        self.num_docs += 1
+        self.num_words += len(words)
+        self.doc_lens.append(len(words))
@@ -0,0 +1,60 @@
+import json
+import numpy as np
+
+# bytes of the similarity block: per query, a float32 similarity and a
+# bool comparison for every target
+EVAL_BLOCK_BYTES = 256 * 2**20
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def self_ranks(queries, targets, rows, block_bytes=EVAL_BLOCK_BYTES):
+    # rank of targets[rows[i]] among all targets by cosine similarity to
+    # queries[i], 0 being the most similar. This is the position of the doc
+    # in model.dv.most_similar(queries[i]), computed with one matrix product
+    # per block of queries instead of a full sort per query.
+    queries = normalize(queries)
+    targets = normalize(targets)
+    rows = np.asarray(rows)
+    ranks = np.empty(len(queries), dtype=np.int64)
+    block_size = max(1, block_bytes // ((4 + 1) * max(len(targets), 1)))
+    for start in range(0, len(queries), block_size):
+        end = start + block_size
+        sims = queries[start:end] @ targets.T
+        own = sims[np.arange(len(sims)), rows[start:end]]
+        ranks[start:end] = (sims > own[:, None]).sum(axis=1)
+    return ranks
+
+
+def self_rank_report(model, X_vectors, sample_size=None, seed=0):
+    # how often a document's inferred vector is closest to its own trained
+    # vector, optionally over a random sample of documents. X_vectors[i] is
+    # the inferred vector of the document tagged i.
+    rows = np.arange(len(X_vectors))
+    if sample_size is not None and sample_size < len(rows):
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(rows, size=sample_size, replace=False))
+    ranks = self_ranks(np.asarray(X_vectors)[rows], model.dv.vectors, rows)
+
+    counts = np.bincount(ranks)
+    return {
+        "num_docs": len(X_vectors),
+        "num_evaluated": len(rows),
+        "rank_0": float(np.mean(ranks == 0)) if len(ranks) else 0.0,
+        "rank_mean": float(ranks.mean()) if len(ranks) else 0.0,
+        "rank_median": float(np.median(ranks)) if len(ranks) else 0.0,
+        "rank_p90": float(np.percentile(ranks, 90)) if len(ranks) else 0.0,
+        # rank -> number of documents, for ranks that occur
+        "histogram": {
+            str(rank): int(count) for rank, count in enumerate(counts) if count
+        },
+    }
+
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
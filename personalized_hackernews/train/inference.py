@@ -0,0 +1,159 @@
+from concurrent.futures import ProcessPoolExecutor
+from gensim.models.doc2vec import (
+    Doc2Vec,
+    train_document_dbow,
+    train_document_dm,
+    train_document_dm_concat,
+)
+from numpy.lib.format import open_memmap
+from train.preprocess import imap_ordered, iter_batches
+
+import numpy as np
+
+INFER_BATCH_SIZE = 256  # docs per worker task
+
+# model and output array of the current worker process, set by _init_worker
+_worker = {}
+
+
+def infer_vector(model, words, seed):
+    # model.infer_vector(words), made reproducible: gensim seeds the initial
+    # vector with python's hash() of the words, which is salted per process,
+    # and negative sampling draws from model.random. Both are seeded from
+    # `seed` here instead.
+    model.random = np.random.RandomState(seed)
+    rng = np.random.default_rng(seed)
+    doctag_vectors = (
+        rng.random((1, model.vector_size), dtype=np.float32) - 0.5
+    ) / model.vector_size
+    doctags_lockf = np.ones(1, dtype=np.float32)
+    work = np.zeros(model.layer1_size, dtype=np.float32)
+    neu1 = np.zeros(model.layer1_size, dtype=np.float32)
+    alpha = model.alpha
+    alpha_delta = (model.alpha - model.min_alpha) / max(model.epochs - 1, 1)
+    for _ in range(model.epochs):
+        if model.sg:
+            train_document_dbow(
+                model,
+                words,
+                [0],
+                alpha,
+                work,
+                learn_words=False,
+                learn_hidden=False,
+                doctag_vectors=doctag_vectors,
+                doctags_lockf=doctags_lockf,
+            )
+        else:
+            train_dm = (
+                train_document_dm_concat
+                if model.dm_concat
+                else train_document_dm
+            )
+            train_dm(
+                model,
+                words,
+                [0],
+                alpha,
+                work,
+                neu1,
+                learn_words=False,
+                learn_hidden=False,
+                doctag_vectors=doctag_vectors,
+                doctags_lockf=doctags_lockf,
+            )
+        alpha -= alpha_delta
+    return doctag_vectors[0]
+
+
+def infer(model, token_lists, seed=0, start=0, out=None):
+    # Doc2Vec vectors of token_lists as a float32 array. The document at
+    # row start + i is inferred with seed + start + i, so its vector does
+    # not depend on how documents are batched or which process infers them.
+    token_lists = list(token_lists)
+    if out is None:
+        out = np.empty((len(token_lists), model.vector_size), np.float32)
+    for i, words in enumerate(token_lists):
+        out[i] = infer_vector(model, words, seed + start + i)
+    return out
+
+
+def _init_worker(model_path, out_path, seed):
+    # the saved weights are memory mapped, so workers share their pages
+    _worker["model"] = Doc2Vec.load(model_path, mmap="r")
+    _worker["out"] = np.load(out_path, mmap_mode="r+")
+    _worker["seed"] = seed
+
+
+def _infer_batch(task):
+    start, token_lists = task
+    end = start + len(token_lists)
+    infer(
+        _worker["model"],
+        token_lists,
+        seed=_worker["seed"],
+        start=start,
+        out=_worker["out"][start:end],
+    )
+    return end - start
+
+
+def infer_vectors(
+    model_path,
+    token_lists,
+    num_docs,
+    out_path,
+    workers=1,
+    seed=0,
+    batch_size=INFER_BATCH_SIZE,
+):
+    # infer the vectors of num_docs token lists with the model saved at
+    # model_path, on a pool of `workers` processes. Vectors are written in
+    # document order to a float32 .npy file at out_path, which is returned
+    # memory mapped.
+    model = Doc2Vec.load(model_path, mmap="r")
+    out = open_memmap(
+        out_path,
+        mode="w+",
+        dtype=np.float32,
+        shape=(num_docs, model.vector_size),
+    )
+    out.flush()
+
+    def tasks():
+        # (first row, token lists) of every batch
+        start = 0
+        for batch in iter_batches(token_lists, batch_size):
+            if start + len(batch) > num_docs:
+                raise ValueError("more than {} documents".format(num_docs))
+            yield start, batch
+            start += len(batch)
+
+    written = 0
+    if workers <= 1:
+        for start, batch in tasks():
+            end = start + len(batch)
+            infer(model, batch, seed=seed, start=start, out=out[start:end])
+            written += end - start
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(model_path, out_path, seed),
+        ) as executor:
+            results = imap_ordered(
+                executor,
+                _infer_batch,
+                ((None, task) for task in tasks()),
+                window=2 * workers,
+            )
+            for _, num_inferred in results:
+                written += num_inferred
+    if written != num_docs:
+        raise ValueError(
+            "expected {} documents, got {}".format(num_docs, written)
+        )
+
+    out.flush()
+    del out
+    return np.load(out_path, mmap_mode="r")
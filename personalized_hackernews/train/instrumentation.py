@@ -0,0 +1,157 @@
+from bisect import bisect_left
+from collections import Counter
+
+import json
+import math
+import pstats
+
+# upper bounds of the latency histogram buckets, in seconds: 10 per decade
+# from 1us to 10s. Histograms of different processes merge by adding.
+LATENCY_BUCKETS = [10 ** (i / 10 - 6) for i in range(71)]
+
+
+class StageStats:
+    # calls, latency, sizes and aborts of one processor of a pipeline
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.items_in = 0
+        self.items_out = 0
+        self.aborts = Counter()
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds, items_in, items_out=None, abort=None):
+        # one call taking `seconds`, from items_in input items to items_out
+        # output items, or aborted with reason `abort`
+        self.calls += 1
+        self.seconds += seconds
+        self.items_in += items_in
+        self.latency_counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if abort is not None:
+            self.aborts[abort] += 1
+        else:
+            self.items_out += items_out
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.items_in += other.items_in
+        self.items_out += other.items_out
+        self.aborts.update(other.aborts)
+        for i, count in enumerate(other.latency_counts):
+            self.latency_counts[i] += count
+
+    def percentile(self, q):
+        # upper bound of the bucket holding the q-th percentile latency
+        if not self.calls:
+            return 0.0
+        rank = math.ceil(q / 100 * self.calls)
+        seen = 0
+        for i, count in enumerate(self.latency_counts):
+            seen += count
+            if seen >= rank:
+                return LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)]
+        return LATENCY_BUCKETS[-1]
+
+    def summary(self):
+        # means per call, aborted calls having no items out
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "mean_ms": 1e3 * self.seconds / self.calls if self.calls else 0.0,
+            "p50_ms": 1e3 * self.percentile(50),
+            "p95_ms": 1e3 * self.percentile(95),
+            "p99_ms": 1e3 * self.percentile(99),
+            "mean_items_in": self.items_in / self.calls if self.calls else 0.0,
+            "mean_items_out": (
+                self.items_out / self.calls if self.calls else 0.0
+            ),
+            "aborts": dict(self.aborts),
+        }
+
+
+class PipelineStats:
+    """
+    StageStats of every processor of the pipelines instrumented with it,
+    by processor name. Stats collected in worker processes are sent back
+    with drain() and added up with merge().
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats()
+        return self.stages[name]
+
+    def merge(self, other):
+        for name, stage in other.stages.items():
+            self.stage(name).merge(stage)
+
+    def drain(self):
+        # the stats collected so far, leaving this object empty
+        drained = PipelineStats()
+        drained.stages = self.stages
+        self.stages = {}
+        return drained
+
+    def to_dict(self):
+        return {name: stage.summary() for name, stage in self.stages.items()}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def table(self):
+        width = max([len("processor")] + [len(name) for name in self.stages])
+        row = "{:<%d} {:>9} {:>9} {:>8} {:>8} {:>8} {:>9} {:>9}  {}" % width
+        header = row.format(
+            "processor",
+            "calls",
+            "total s",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "items in",
+            "items out",
+            "aborts",
+        )
+        lines = [header, "-" * len(header)]
+        for name, summary in self.to_dict().items():
+            lines.append(
+                row.format(
+                    name,
+                    summary["calls"],
+                    "{:.3f}".format(summary["seconds"]),
+                    "{:.3f}".format(summary["p50_ms"]),
+                    "{:.3f}".format(summary["p95_ms"]),
+                    "{:.3f}".format(summary["p99_ms"]),
+                    "{:.1f}".format(summary["mean_items_in"]),
+                    "{:.1f}".format(summary["mean_items_out"]),
+                    ", ".join(
+                        "{}: {}".format(reason, count)
+                        for reason, count in summary["aborts"].items()
+                    ),
+                )
+            )
+        return "\n".join(lines)
+
+
+class ProfileData:
+    # cProfile results in the form pstats loads, so profiles of sampled
+    # docs can be sent between processes and added up
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def merge_profiles(profile, stats):
+    # add the cProfile stats dict `stats` to `profile`, a pstats.Stats or
+    # None
+    if profile is None:
+        return pstats.Stats(ProfileData(stats))
+    profile.add(ProfileData(stats))
+    return profile
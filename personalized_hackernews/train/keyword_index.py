@@ -0,0 +1,171 @@
+from collections import Counter
+from functools import reduce
+
+import numpy as np
+import os
+
+
+class KeywordIndex:
+    """
+    Inverted index from term to document rows, scored with BM25.
+
+    Documents are identified by their row in X_vectors.npy. Terms are
+    sorted, so a term is found by binary search without building a dict
+    when the arrays are memory mapped. Postings are stored CSR-style: the
+    rows and term frequencies of term i live in
+    `doc_rows[offsets[i]:offsets[i + 1]]` and `term_freqs[...]`, sorted by
+    row.
+    """
+
+    ARRAYS = ["terms", "offsets", "doc_rows", "term_freqs", "doc_lens"]
+
+    def __init__(self, terms, offsets, doc_rows, term_freqs, doc_lens):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_rows = doc_rows
+        self.term_freqs = term_freqs
+        self.doc_lens = doc_lens
+        self.avg_doc_len = float(doc_lens.mean()) if len(doc_lens) else 0.0
+
+    @classmethod
+    def build(cls, token_lists):
+        # token_lists yields the tokenized text of every document, by row;
+        # it is read once, so it can stream from a corpus file
+        vocab = {}
+        term_ids, rows, freqs, doc_lens = [], [], [], []
+        for row, tokens in enumerate(token_lists):
+            doc_lens.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                rows.append(row)
+                freqs.append(freq)
+
+        # ids of the terms in sorted order
+        terms = np.asarray(list(vocab), dtype=str)
+        by_term = np.argsort(terms, kind="stable")
+        sorted_ids = np.empty(len(terms), dtype=np.int64)
+        sorted_ids[by_term] = np.arange(len(terms))
+        term_ids = sorted_ids[np.asarray(term_ids, dtype=np.int64)]
+        # rows were appended in increasing order, so a stable sort by term
+        # keeps every posting list sorted by row
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=offsets[1:])
+
+        return cls(
+            terms[by_term],
+            offsets,
+            np.asarray(rows, dtype=np.int32)[order],
+            np.asarray(freqs, dtype=np.int32)[order],
+            np.asarray(doc_lens, dtype=np.int32),
+        )
+
+    def merge(self, other):
+        # new index with the documents of `other` appended after the rows
+        # of this one
+        terms = np.union1d(self.terms, other.terms)
+
+        # term id of every posting, this index's postings first so a stable
+        # sort by term keeps every posting list sorted by row
+        posting_terms = np.concatenate(
+            [
+                np.repeat(
+                    np.searchsorted(terms, self.terms), np.diff(self.offsets)
+                ),
+                np.repeat(
+                    np.searchsorted(terms, other.terms), np.diff(other.offsets)
+                ),
+            ]
+        )
+        order = np.argsort(posting_terms, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(posting_terms, minlength=len(terms)),
+            out=offsets[1:],
+        )
+        return KeywordIndex(
+            terms,
+            offsets,
+            np.concatenate([self.doc_rows, other.doc_rows + len(self)])[order],
+            np.concatenate([self.term_freqs, other.term_freqs])[order],
+            np.concatenate([self.doc_lens, other.doc_lens]),
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        # with mmap_mode="r" the terms and postings are paged in from disk
+        # and shared between processes
+        arrays = [
+            np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in cls.ARRAYS
+        ]
+        return cls(*arrays)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    def term_id(self, term):
+        # position of term in the sorted terms, or None
+        i = int(np.searchsorted(self.terms, term))
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return None
+
+    def postings(self, term):
+        term_id = self.term_id(term)
+        if term_id is None:
+            empty = np.empty(0, dtype=np.int32)
+            return empty, empty
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_rows[start:end], self.term_freqs[start:end]
+
+    def bm25(self, term, k1=1.2, b=0.75):
+        # BM25 score of `term` for every row in its posting list
+        rows, freqs = self.postings(term)
+        df = len(rows)
+        idf = np.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * self.doc_lens[rows] / self.avg_doc_len)
+        return rows, idf * freqs * (k1 + 1) / (freqs + norm)
+
+    def search(self, keywords, mode="or", k=None):
+        # keywords is a list of keywords, each a list of terms. A keyword
+        # matches a document that contains all of its terms; with mode "or"
+        # a document must match any keyword, with mode "and" every keyword.
+        # returns matching rows and their summed BM25 scores, best first.
+        assert mode in ["or", "and"]
+        combine = np.union1d if mode == "or" else np.intersect1d
+
+        matched = None
+        row_parts, score_parts = [], []
+        for terms in keywords:
+            if not terms:
+                continue
+            scored = [self.bm25(term) for term in set(terms)]
+            keyword_rows = reduce(np.intersect1d, [rows for rows, _ in scored])
+            matched = (
+                keyword_rows
+                if matched is None
+                else combine(matched, keyword_rows)
+            )
+            for rows, scores in scored:
+                row_parts.append(rows)
+                score_parts.append(scores)
+
+        if matched is None or len(matched) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+
+        rows = np.concatenate(row_parts)
+        scores = np.concatenate(score_parts)
+        keep = np.isin(rows, matched)
+        rows, inverse = np.unique(rows[keep], return_inverse=True)
+        scores = np.bincount(inverse, weights=scores[keep])
+
+        order = np.argsort(-scores, kind="stable")
+        if k is not None:
+            order = order[:k]
+        return rows[order], scores[order]
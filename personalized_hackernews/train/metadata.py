@@ -0,0 +1,154 @@
+from urllib.parse import urlparse
+
+import numpy as np
+import os
+
+
+def first(value, default=""):
+    # scraped fields are lists of values (see scraping.items); use the first
+    if isinstance(value, list):
+        return value[0] if value else default
+    return default if value is None else value
+
+
+class StringColumn:
+    # strings stored back to back in one utf-8 buffer, delimited by offsets,
+    # so a column is two flat arrays instead of one python object per row
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    @classmethod
+    def load(cls, path, name, mmap_mode=None):
+        return cls(
+            np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, name + "_offsets.npy")),
+        )
+
+    def save(self, path, name):
+        np.save(os.path.join(path, name + ".npy"), self.blob)
+        np.save(os.path.join(path, name + "_offsets.npy"), self.offsets)
+
+    def concat(self, other):
+        return StringColumn(
+            np.concatenate([self.blob, other.blob]),
+            np.concatenate(
+                [self.offsets, other.offsets[1:] + self.offsets[-1]]
+            ),
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return self.blob.nbytes + self.offsets.nbytes
+
+
+class MetadataStore:
+    """
+    What the app needs to render a document, by X_vectors row: title, href,
+    insertion time and the domain, precomputed and interned (every row
+    stores a code into the table of distinct domains). Paragraphs and the
+    other fields stay in Mongo.
+    """
+
+    COLUMNS = ["title", "href", "insertion_time"]
+
+    def __init__(self, columns, domains, domain_codes):
+        self.columns = columns
+        self.domains = domains
+        self.domain_codes = domain_codes
+
+    @classmethod
+    def build(cls, docs):
+        columns = {name: [] for name in cls.COLUMNS}
+        domain_ids = {}
+        domain_codes = np.empty(len(docs), dtype=np.int32)
+        for row, doc in enumerate(docs):
+            for name in cls.COLUMNS:
+                columns[name].append(str(first(doc.get(name))))
+            domain = urlparse(columns["href"][-1]).netloc
+            domain_codes[row] = domain_ids.setdefault(domain, len(domain_ids))
+        return cls(
+            {
+                name: StringColumn.from_strings(values)
+                for name, values in columns.items()
+            },
+            StringColumn.from_strings(list(domain_ids)),
+            domain_codes,
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        return cls(
+            {
+                name: StringColumn.load(path, name, mmap_mode=mmap_mode)
+                for name in cls.COLUMNS
+            },
+            StringColumn.load(path, "domains"),
+            np.load(
+                os.path.join(path, "domain_codes.npy"), mmap_mode=mmap_mode
+            ),
+        )
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name, column in self.columns.items():
+            column.save(path, name)
+        self.domains.save(path, "domains")
+        np.save(os.path.join(path, "domain_codes.npy"), self.domain_codes)
+
+    def append(self, docs):
+        # new store with docs appended after the rows of this one
+        other = MetadataStore.build(docs)
+        domain_ids = {self.domains[i]: i for i in range(len(self.domains))}
+        # codes of the other store's domains in the merged domain table
+        remap = np.asarray(
+            [
+                domain_ids.setdefault(other.domains[i], len(domain_ids))
+                for i in range(len(other.domains))
+            ],
+            dtype=np.int32,
+        )
+        return MetadataStore(
+            {
+                name: column.concat(other.columns[name])
+                for name, column in self.columns.items()
+            },
+            StringColumn.from_strings(list(domain_ids)),
+            np.concatenate(
+                [self.domain_codes, remap[other.domain_codes]]
+            ).astype(np.int32),
+        )
+
+    def __len__(self):
+        return len(self.domain_codes)
+
+    def row(self, i):
+        entry = {name: column[i] for name, column in self.columns.items()}
+        entry["domain_name"] = self.domains[self.domain_codes[i]]
+        return entry
+
+    def rows(self, rows):
+        return [self.row(i) for i in rows]
+
+    @property
+    def nbytes(self):
+        return (
+            sum(column.nbytes for column in self.columns.values())
+            + self.domains.nbytes
+            + self.domain_codes.nbytes
+        )
@@ -0,0 +1,178 @@
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from train.instrumentation import merge_profiles
+from train.token_cache import content_key
+
+import cProfile
+
+# fields the tokenizer reads; _id is always returned by mongo
+PREPROCESS_PROJECTION = {
+    "title": 1,
+    "subtitles": 1,
+    "paragraphs": 1,
+    "href": 1,
+    "insertion_time": 1,
+}
+# fields kept in memory for every document that survives preprocessing
+KEEP_FIELDS = ["_id", "title", "href", "insertion_time"]
+
+# transform, stats and profiler of the current worker process, set by
+# _init_worker
+_worker = {}
+
+
+def iter_batches(cursor, batch_size):
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_worker(transform, stats=None, profile_every=0):
+    _worker["transform"] = transform
+    _worker["stats"] = stats
+    _worker["profile_every"] = profile_every
+    _worker["profiler"] = cProfile.Profile() if profile_every else None
+    _worker["num_docs"] = 0
+
+
+def _transform_batch(docs):
+    # (drop reason, tokens) for every doc of the batch, the drop reason
+    # None for kept docs; with the stats collected since the previous batch
+    # and the cProfile stats of the batch's sampled docs, if any
+    transform = _worker["transform"]
+    profiler = _worker["profiler"]
+    results = []
+    profiled = False
+    for doc in docs:
+        _worker["num_docs"] += 1
+        if (
+            profiler is not None
+            and _worker["num_docs"] % _worker["profile_every"] == 0
+        ):
+            profiler.enable()
+            results.append(transform(doc))
+            profiler.disable()
+            profiled = True
+        else:
+            results.append(transform(doc))
+
+    stats = _worker["stats"]
+    if stats is not None:
+        stats = stats.drain()
+    profile = None
+    if profiled:
+        profiler.create_stats()
+        profile = profiler.stats
+        _worker["profiler"] = cProfile.Profile()
+    return results, stats, profile
+
+
+def imap_ordered(executor, fn, iterable, window):
+    # like executor.map over the args of (context, arg) pairs, yielding
+    # (context, result), but keeps at most `window` tasks in flight so the
+    # input is streamed instead of read up front
+    pending = deque()
+    for context, arg in iterable:
+        pending.append((context, executor.submit(fn, arg)))
+        if len(pending) >= window:
+            context, future = pending.popleft()
+            yield context, future.result()
+    while pending:
+        context, future = pending.popleft()
+        yield context, future.result()
+
+
+class Preprocessor:
+    """
+    Runs `transform(doc) -> (drop reason, tokens)` over documents in
+    batches on a pool of `workers` processes. run() streams (doc, tokens)
+    for every kept document in input order, with doc trimmed to
+    KEEP_FIELDS; dropped documents are counted by reason in `drops`.
+    With a TokenCache, only documents missing from it are transformed.
+    The PipelineStats `stats`, which transform's pipelines record into,
+    are gathered from the workers, and with profile_every, one in every
+    profile_every docs a worker transforms is profiled into `profile`.
+    """
+
+    def __init__(
+        self,
+        transform,
+        workers=1,
+        batch_size=256,
+        cache=None,
+        stats=None,
+        profile_every=0,
+    ):
+        self.transform = transform
+        self.workers = workers
+        self.batch_size = batch_size
+        self.cache = cache
+        self.stats = stats
+        self.profile_every = profile_every
+        self.profile = None  # pstats.Stats
+        self.drops = Counter()
+        self.dropped_ids = []  # str _ids of the dropped docs
+        self.num_docs = 0
+
+    def run(self, docs):
+        jobs = self._lookup(iter_batches(docs, self.batch_size))
+        if self.workers <= 1:
+            _init_worker(self.transform, self.stats, self.profile_every)
+            results = (
+                (context, _transform_batch(misses)) for context, misses in jobs
+            )
+            yield from self._collect(results)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.transform, self.stats, self.profile_every),
+        ) as executor:
+            results = imap_ordered(
+                executor, _transform_batch, jobs, window=2 * self.workers
+            )
+            yield from self._collect(results)
+
+    def _lookup(self, batches):
+        # yields ((batch, keys, cached results), docs to transform)
+        for batch in batches:
+            if self.cache is None:
+                yield (batch, None, [None] * len(batch)), batch
+                continue
+            keys = [content_key(doc) for doc in batch]
+            found = self.cache.get_many(keys)
+            cached = [found.get(key) for key in keys]
+            misses = [doc for doc, hit in zip(batch, cached) if hit is None]
+            yield (batch, keys, cached), misses
+
+    def _collect(self, results):
+        for (batch, keys, cached), (computed, stats, profile) in results:
+            if stats is not None:
+                self.stats.merge(stats)
+            if profile is not None:
+                self.profile = merge_profiles(self.profile, profile)
+            computed = iter(computed)
+            new_entries = []
+            for i, doc in enumerate(batch):
+                result = cached[i]
+                if result is None:
+                    result = next(computed)
+                    if keys is not None:
+                        new_entries.append((keys[i], result))
+                drop_reason, tokens = result
+                self.num_docs += 1
+                if drop_reason is not None:
+                    self.drops[drop_reason] += 1
+                    self.dropped_ids.append(str(doc["_id"]))
+                    continue
+                yield {
+                    field: doc[field] for field in KEEP_FIELDS if field in doc
+                }, tokens
+            if new_entries:
+                self.cache.put_many(new_entries)
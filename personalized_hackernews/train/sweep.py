@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+import json
+import numpy as np
+
+SWEEP_BATCH_SIZE = 1024  # MiniBatchKMeans batch size
+SWEEP_SAMPLE_SIZE = 10000  # docs the candidate clusterings are scored on
+# ks per parallel chunk at least, so most ks are warm started
+SWEEP_MIN_CHUNK_SIZE = 4
+
+# vectors and sample of the current worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(X_path, sample, metric, seed):
+    # every worker memory maps the vectors instead of receiving a copy
+    _worker.update(
+        X=np.load(X_path, mmap_mode="r"),
+        sample=sample,
+        metric=metric,
+        seed=seed,
+    )
+
+
+def _sq_dists(points, centers):
+    # squared distance of every point to every center
+    sq_dists = (
+        np.einsum("ij,ij->i", points, points)[:, None]
+        - 2 * points @ centers.T
+        + np.einsum("ij,ij->i", centers, centers)[None, :]
+    )
+    return np.maximum(sq_dists, 0)
+
+
+def _warm_start(centers, sample, k):
+    # previous centers plus the sample points farthest from them
+    if k - len(centers) > len(sample):
+        return "k-means++"
+    farthest = np.argsort(
+        -_sq_dists(sample, centers).min(axis=1), kind="stable"
+    )
+    return np.vstack([centers, sample[farthest[: k - len(centers)]]])
+
+
+def _fit_chunk(ks):
+    # fit increasing ks, each warm started from the previous solution
+    X, sample = _worker["X"], _worker["sample"]
+    scores = []
+    centers = None
+    for k in ks:
+        kmeans = MiniBatchKMeans(
+            n_clusters=k,
+            init=(
+                "k-means++"
+                if centers is None
+                else _warm_start(centers, sample, k)
+            ),
+            n_init=1,
+            batch_size=SWEEP_BATCH_SIZE,
+            random_state=_worker["seed"],
+        ).fit(X)
+        centers = kmeans.cluster_centers_
+        sq_dists = _sq_dists(sample, centers)
+        labels = sq_dists.argmin(axis=1)
+        if _worker["metric"] == "inertia":
+            # mean squared distance of the sample to its nearest centroid
+            scores.append(float(sq_dists.min(axis=1).mean()))
+        elif len(np.unique(labels)) > 1:
+            scores.append(float(silhouette_score(sample, labels)))
+        else:
+            scores.append(-1.0)
+    return scores
+
+
+def find_elbow(ks, scores, decreasing=True):
+    # kneedle: the point of the normalized curve farthest above the line
+    # joining its ends
+    x = np.asarray(ks, dtype=float)
+    y = np.asarray(scores, dtype=float)
+    if len(x) < 3:
+        return int(x[np.argmin(y) if decreasing else np.argmax(y)])
+    x = (x - x.min()) / (x.max() - x.min())
+    y = (y - y.min()) / max(y.max() - y.min(), np.finfo(float).tiny)
+    if decreasing:
+        y = 1 - y
+    return int(ks[np.argmax(y - x)])
+
+
+def sweep_kmeans(
+    X_path,
+    ks,
+    metric="inertia",
+    workers=1,
+    sample_size=SWEEP_SAMPLE_SIZE,
+    seed=0,
+):
+    """
+    Fits MiniBatchKMeans for every k in ks on the float32 vectors saved in
+    X_path, memory mapped by every worker, and scores it on a random sample
+    of them: "inertia" is the mean squared distance to the nearest centroid
+    (lower is better, the chosen k is the elbow of the curve), "silhouette"
+    the silhouette score (higher is better, the chosen k is the best one).
+    ks are split into contiguous chunks of at least SWEEP_MIN_CHUNK_SIZE ks
+    fitted in parallel, each k warm started from the previous one of its
+    chunk.
+    """
+    assert metric in ["inertia", "silhouette"]
+    X = np.load(X_path, mmap_mode="r")
+    assert X.dtype == np.float32
+    ks = sorted(k for k in ks if k <= len(X))
+    if not ks:
+        raise ValueError("no k of the sweep is at most {}".format(len(X)))
+    rng = np.random.default_rng(seed)
+    sample = X
+    if sample_size is not None and sample_size < len(X):
+        sample = X[np.sort(rng.choice(len(X), sample_size, replace=False))]
+    sample = np.asarray(sample)
+
+    num_chunks = max(1, min(workers, len(ks) // SWEEP_MIN_CHUNK_SIZE))
+    chunks = [chunk.tolist() for chunk in np.array_split(ks, num_chunks)]
+    if num_chunks == 1:
+        _init_worker(X_path, sample, metric, seed)
+        chunk_scores = map(_fit_chunk, chunks)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=num_chunks,
+            initializer=_init_worker,
+            initargs=(X_path, sample, metric, seed),
+        ) as executor:
+            chunk_scores = list(executor.map(_fit_chunk, chunks))
+    scores = [score for chunk in chunk_scores for score in chunk]
+
+    if metric == "inertia":
+        best_k = find_elbow(ks, scores, decreasing=True)
+    else:
+        best_k = int(ks[int(np.argmax(scores))])
+    return {
+        "metric": metric,
+        "num_docs": len(X),
+        "sample_size": len(sample),
+        "ks": ks,
+        "scores": scores,
+        "best_k": best_k,
+    }
+
+
+def save_sweep(result, path):
+    # writes path.json and path.png; the figure is drawn without pyplot so
+    # no display is needed
+    with open(path + ".json", "w") as f:
+        json.dump(result, f, indent=2)
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(result["ks"], result["scores"], marker=".")
+    ax.axvline(result["best_k"], color="red", linestyle="--")
+    ax.set_xlabel("n_clusters")
+    ax.set_ylabel(result["metric"])
+    ax.set_title("kmeans sweep, best k = {}".format(result["best_k"]))
+    fig.savefig(path + ".png")
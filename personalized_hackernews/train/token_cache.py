@@ -0,0 +1,95 @@
+import hashlib
+import json
+import sqlite3
+
+# document fields the tokenization result depends on; href is included
+# because the site filter reads it
+CONTENT_FIELDS = ["href", "title", "subtitles", "paragraphs"]
+# sqlite limits the number of parameters of one statement
+MAX_LOOKUP = 500
+
+
+def content_key(doc):
+    # digest of everything preprocess_instance reads from doc
+    content = json.dumps(
+        [doc.get(field) for field in CONTENT_FIELDS],
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha1(content.encode("utf-8")).digest()
+
+
+class TokenCache:
+    """
+    Persistent cache of preprocessing results, (drop reason, tokens), keyed
+    by content_key of the document. Entries are only valid for the
+    pipeline configuration they were computed with: opening the cache with
+    a different fingerprint discards them.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "key BLOB PRIMARY KEY, fingerprint TEXT, reason TEXT, tokens TEXT)"
+        )
+        self.conn.execute(
+            "DELETE FROM tokens WHERE fingerprint != ?", (fingerprint,)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_many(self, keys):
+        # {key: (drop reason, tokens)} of the keys found in the cache
+        found = {}
+        for start in range(0, len(keys), MAX_LOOKUP):
+            chunk = keys[start : start + MAX_LOOKUP]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                "SELECT key, reason, tokens FROM tokens "
+                "WHERE key IN ({})".format(placeholders),
+                chunk,
+            )
+            for key, reason, tokens in rows:
+                found[key] = (
+                    reason,
+                    None if tokens is None else tokens.split(),
+                )
+        hits = sum(key in found for key in keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        # items is a list of (key, (drop reason, tokens))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)",
+            [
+                (
+                    key,
+                    self.fingerprint,
+                    reason,
+                    None if tokens is None else " ".join(tokens),
+                )
+                for key, (reason, tokens) in items
+            ],
+        )
+        self.conn.commit()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,71 @@
+import gensim
+import re
+
+# a token is a maximal run of letters (word characters other than digits,
+# so "_" included) that does not start with "_", as in simple_preprocess
+TOKEN_PATTERN = r"(?<![^\W\d])(?!_)[^\W\d]{{{min_len},{max_len}}}(?![^\W\d])"
+
+
+class SimplePreprocessTokenizer:
+    # gensim.utils.simple_preprocess, one call per text
+    name = "simple_preprocess"
+
+    def __init__(self, min_len=2, max_len=15):
+        self.min_len = min_len
+        self.max_len = max_len
+
+    def tokenize(self, text):
+        return gensim.utils.simple_preprocess(
+            text, min_len=self.min_len, max_len=self.max_len
+        )
+
+    def tokenize_joined(self, texts):
+        # tokens of all texts, in order
+        return [token for text in texts for token in self.tokenize(text)]
+
+    def params(self):
+        return {"min_len": self.min_len, "max_len": self.max_len}
+
+
+class RegexTokenizer:
+    """
+    Same tokens as simple_preprocess (without deaccenting), found by one
+    precompiled regex: the length filters are part of the pattern instead
+    of a python-level pass over every token, and tokenize_joined runs it
+    once over all texts joined by newlines, which never occur in a token.
+    """
+
+    name = "regex"
+
+    def __init__(self, lowercase=True, min_len=2, max_len=15):
+        self.lowercase = lowercase
+        self.min_len = min_len
+        self.max_len = max_len
+        self.pattern = re.compile(
+            TOKEN_PATTERN.format(min_len=min_len, max_len=max_len)
+        )
+
+    def tokenize(self, text):
+        if self.lowercase:
+            text = text.lower()
+        return self.pattern.findall(text)
+
+    def tokenize_joined(self, texts):
+        return self.tokenize("\n".join(texts))
+
+    def params(self):
+        return {
+            "lowercase": self.lowercase,
+            "min_len": self.min_len,
+            "max_len": self.max_len,
+        }
+
+
+TOKENIZERS = {
+    SimplePreprocessTokenizer.name: SimplePreprocessTokenizer,
+    RegexTokenizer.name: RegexTokenizer,
+}
+
+
+def make_tokenizer(name, **kwargs):
+    return TOKENIZERS[name](**kwargs)
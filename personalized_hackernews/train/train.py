@@ -1,17 +1,31 @@
 # from nltk.corpus import stopwords
-from collections import Counter
+from functools import partial
 from pymongo import MongoClient
-from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+from gensim.models.doc2vec import Doc2Vec
 from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
 from sklearn.preprocessing import MinMaxScaler
 from tqdm import tqdm
+from train.analysis import write_analysis
+from train.bundle import export_bundle, prune_versions, set_current_version
+from train.corpus import CorpusWriter, LineCorpus
+from train.evaluation import self_rank_report, write_report
+from train.inference import infer_vectors
+from train.instrumentation import PipelineStats
+from train.keyword_index import KeywordIndex
+from train.metadata import MetadataStore
+from train.preprocess import PREPROCESS_PROJECTION, Preprocessor
+from train.sweep import save_sweep, sweep_kmeans
+from train.token_cache import TokenCache
+from train.tokenizers import SimplePreprocessTokenizer, make_tokenizer
+from train.writeback import write_back
 
 import gensim
+import json
+import os
+import time
 
 # import nltk
 import numpy as np
-import matplotlib.pyplot as plt
 
 # nltk.download('stopwords')
 import pickle
@@ -19,23 +33,212 @@ import pickle
 DEBUG = False
 EXCLUDE_SITES = set(["www.ft.com"])
 DO_HYPTERTUNE = False
+NUM_CLUSTERS = 30  # kmeans n_clusters, unless picked by the sweep
+SWEEP_K_RANGE = range(50, 1000, 20)  # n_clusters tried by the sweep
+SWEEP_METRIC = "inertia"  # or "silhouette"
+SWEEP_WORKERS = os.cpu_count()
+SWEEP_REPORT = "kmeans_sweep"  # .json and .png
+ANALYSIS_DIR = "analysis"  # cluster analysis report, json and png
+ANALYSIS_PCA = True  # also plot a 2d PCA projection of the vectors
+# "labels" sets labels of the docs filtered_hn_sites already has and syncs
+# the rest; "swap" rebuilds it in a staging collection and renames it over
+WRITEBACK_MODE = "labels"
+WRITEBACK_BATCH_SIZE = 1000
+BUNDLE_DIR = "bundle"  # serving artifacts loaded by the app
+# bundle versions kept after training or an update, besides the current
+# one; older ones are deleted
+KEEP_VERSIONS = 3
+PREPROCESS_WORKERS = os.cpu_count()  # tokenizing processes
+PREPROCESS_BATCH_SIZE = 256  # docs per cursor batch and per worker task
+CORPUS_FILE = "corpus.txt"  # tokenized corpus, one document per line
+# train Doc2Vec with gensim's corpus_file mode; otherwise stream CORPUS_FILE
+# through a restartable iterable
+TRAIN_FROM_CORPUS_FILE = True
+# preprocessing results of unchanged documents are reused from this file
+# across runs; None tokenizes everything
+TOKEN_CACHE_FILE = "token_cache.sqlite"
+SANITY_SAMPLE_SIZE = None  # docs to self-rank, None for all of them
+SANITY_REPORT_FILE = "sanity_report.json"  # self-rank statistics
+MODEL_FILE = "gensim.model"
+INFER_WORKERS = os.cpu_count()  # document vector inference processes
+INFER_SEED = 0  # inferred vectors are reproducible for a given seed
+INFERRED_VECTORS_FILE = "inferred_vectors.npy"  # before standardizing
+# training docs inferred again, with other seeds, after kmeans is fitted:
+# like the docs train.update adds, their vectors were not fitted, so their
+# distances to the centroids are the baseline of its drift report
+DRIFT_BASELINE_SIZE = 1000
+DRIFT_BASELINE_VECTORS_FILE = "drift_baseline_vectors.npy"
+X_VECTORS_FILE = "X_vectors.npy"  # standardized, kmeans features
+# tokenizer backend of the pipelines, see train.tokenizers; "regex" gives
+# the same tokens as "simple_preprocess", faster
+TOKENIZER = "regex"
+# calls, latency, sizes and aborts of the training pipelines; None turns the
+# instrumentation off
+PIPELINE_STATS_FILE = "pipeline_stats.json"
+# time every processor of the pipelines on its own rather than each pipeline
+# as one streaming pass; materializes the output of every processor
+PIPELINE_STATS_PER_STAGE = False
+# profile one in every PROFILE_EVERY transformed docs with cProfile, per
+# worker, into PROFILE_FILE (pstats format); 0 turns profiling off
+PROFILE_EVERY = 0
+PROFILE_FILE = "preprocess.prof"
+
+
+def materialized(stage, items):
+    # output of a streaming stage as a list
+    return list(stage(iter(items)))
 
 
 class DataPipeline:
     def __init__(self):
         self.postprocessors = []
+        # stages of the compiled pipeline and whether each one streams, see
+        # compile()
+        self.stages = None
+        self.stage_names = None
+        self.stage_streams = None
+        # PipelineStats recording every call, see instrument()
+        self.stats = None
+        self.per_stage = False
+
+    def compile(self):
+        # fuse the processors into one pass: each stage is a generator over
+        # the output of the previous one, so no intermediate lists are built
+        # and a processor can abort before its input is exhausted. Adjacent
+        # processors that fuse() run as a single stage; processors without
+        # stream() transform the whole output of the previous stage, as
+        # uncompiled. Pipelines are compiled until another processor is
+        # registered.
+        processors = [processor for processor, _ in self.postprocessors]
+        self.stages = []
+        self.stage_names = []
+        self.stage_streams = []
+        i = 0
+        while i < len(processors):
+            fused = None
+            if i + 1 < len(processors):
+                fused = processors[i].fuse(processors[i + 1])
+            if fused is not None:
+                self.stages.append(fused)
+                self.stage_names.append(
+                    processors[i].name + "+" + processors[i + 1].name
+                )
+                self.stage_streams.append(True)
+                i += 2
+            else:
+                streams = processors[i].stream is not None
+                self.stages.append(
+                    processors[i].stream
+                    if streams
+                    else processors[i].transform
+                )
+                self.stage_names.append(processors[i].name)
+                self.stage_streams.append(streams)
+                i += 1
+        return self
+
+    def instrument(self, stats, per_stage=False):
+        # record calls, latency, input/output sizes and aborts into stats, a
+        # PipelineStats that may be shared by several pipelines; None turns
+        # it off. Compiled pipelines are timed as one streaming pass, under
+        # the names of their stages joined by "+"; per_stage times every
+        # stage on the materialized output of the previous one instead,
+        # which costs the streaming. Uncompiled pipelines are timed per
+        # processor.
+        self.stats = stats
+        self.per_stage = per_stage
+        return self
 
     def transform(self, data, DEBUG=False):
+        if self.stats is not None:
+            return self.transform_instrumented(data, DEBUG=DEBUG)
+        if self.stages is not None and not DEBUG:
+            return self.transform_compiled(data)
         for pp in self.postprocessors:
             processor, _ = pp
             try:
                 data = processor.transform(data, DEBUG=DEBUG)
             except AbortException as e:
-                print("dropping example because of {}".format(e))
+                if DEBUG:
+                    print("dropping example because of {}".format(e))
+                return None
+        return data
+
+    def transform_compiled(self, data):
+        try:
+            return self.run_compiled(data)
+        except AbortException:
+            return None
+
+    def run_compiled(self, data):
+        # streaming stages are chained lazily and materialized only before
+        # a stage that does not stream, or at the end
+        streaming = False
+        for stage, streams in zip(self.stages, self.stage_streams):
+            if streams:
+                data = stage(data if streaming else iter(data))
+            else:
+                data = stage(list(data) if streaming else data)
+            streaming = streams
+        return list(data) if streaming else data
+
+    def transform_instrumented(self, data, DEBUG=False):
+        if self.stages is not None and not DEBUG:
+            if not self.per_stage:
+                return self.timed(
+                    "+".join(self.stage_names),
+                    self.run_compiled,
+                    data,
+                )
+            steps = [
+                (
+                    name,
+                    partial(materialized, stage) if streams else stage,
+                )
+                for name, stage, streams in zip(
+                    self.stage_names, self.stages, self.stage_streams
+                )
+            ]
+        else:
+            steps = [
+                (
+                    processor.name,
+                    partial(processor.transform, DEBUG=DEBUG),
+                )
+                for processor, _ in self.postprocessors
+            ]
+        for name, step in steps:
+            data = self.timed(name, step, data, DEBUG=DEBUG)
+            if data is None:
                 return None
         return data
 
+    def timed(self, name, step, data, DEBUG=False):
+        # step(data) timed into the stats of `name`, or None if it aborted
+        items_in = len(data)
+        start = time.perf_counter()
+        try:
+            data = step(data)
+        except AbortException as e:
+            self.stats.stage(name).record(
+                time.perf_counter() - start,
+                items_in,
+                abort=str(e) or type(e).__name__,
+            )
+            if DEBUG:
+                print("dropping example because of {}".format(e))
+            return None
+        self.stats.stage(name).record(
+            time.perf_counter() - start, items_in, len(data)
+        )
+        return data
+
+    def transform_many(self, datas, DEBUG=False):
+        # transform of every input, None for the dropped ones
+        return [self.transform(data, DEBUG=DEBUG) for data in datas]
+
     def register_postprocessor(self, postprocessor, order):
+        self.stages = None
         if not self.postprocessors:
             self.postprocessors = [(postprocessor, order)]
         else:
@@ -49,6 +252,14 @@ class DataPipeline:
 
             self.postprocessors.insert(insert_idx, (postprocessor, order))
 
+    def fingerprint(self):
+        # configuration of the registered processors, in order; changes
+        # whenever the pipeline would tokenize differently
+        return [
+            [order, type(processor).__name__, processor.params()]
+            for processor, order in self.postprocessors
+        ]
+
 
 class Processor(object):
     def __init__(self, name, *args, **kwargs):
@@ -59,6 +270,21 @@ class Processor(object):
         # output modified list
         pass
 
+    # lazy transform over an iterator of input items, used by compiled
+    # pipelines: stream(items, DEBUG=False) yields the output items.
+    # Processors that leave it None, like doc level ones, transform the
+    # whole output of the previous stage.
+    stream = None
+
+    def fuse(self, processor):
+        # stream of this processor followed by `processor` in one stage,
+        # for compiled pipelines, or None if they do not fuse
+        return None
+
+    def params(self):
+        # settings that change the output of transform, for fingerprints
+        return {}
+
     def log(self, msg):
         print("[{}] {}".format(self.name.upper(), msg))
 
@@ -80,15 +306,20 @@ class ExcludeSitePreProcessor(Processor):
             self.log(doc)
         return doc
 
+    def params(self):
+        return {"exclude_sites": sorted(self.exclude_sites)}
+
 
 class GenSimProcessor(Processor):
-    def __Init__(self, name):
+    def __init__(self, name, tokenizer=None):
         Processor.__init__(self, name)
+        # any backend of train.tokenizers; simple_preprocess by default
+        self.tokenizer = tokenizer or SimplePreprocessTokenizer()
 
     def transform(self, pgraphs, DEBUG=False):
         tokens_list = []
         for pgraph in pgraphs:
-            tokens = gensim.utils.simple_preprocess(pgraph)
+            tokens = self.tokenizer.tokenize(pgraph)
 
             if tokens:
                 tokens_list.append(tokens)
@@ -96,6 +327,24 @@ class GenSimProcessor(Processor):
             self.log(tokens_list)
         return tokens_list
 
+    def stream(self, pgraphs, DEBUG=False):
+        for pgraph in pgraphs:
+            tokens = self.tokenizer.tokenize(pgraph)
+            if tokens:
+                yield tokens
+
+    def fuse(self, processor):
+        # tokenizing then flattening is one pass over the joined paragraphs
+        if type(processor) is FlattenProcessor:
+            return self.stream_flat
+        return None
+
+    def stream_flat(self, pgraphs, DEBUG=False):
+        return iter(self.tokenizer.tokenize_joined(list(pgraphs)))
+
+    def params(self):
+        return dict(self.tokenizer.params(), tokenizer=self.tokenizer.name)
+
 
 class WordCountLimitProcessor(Processor):
     def __init__(self, name, word_count_lb):
@@ -111,6 +360,24 @@ class WordCountLimitProcessor(Processor):
             self.log(word_list)
         return word_list
 
+    def stream(self, words, DEBUG=False):
+        # words are held back only until the threshold is met; after that
+        # the doc is kept and the rest passes through uncounted
+        held = []
+        if self.word_count_thres > 0:
+            for word in words:
+                held.append(word)
+                if len(held) >= self.word_count_thres:
+                    break
+            else:
+                self.num_drops += 1
+                raise AbortException("word count threshold is not met")
+        yield from held
+        yield from words
+
+    def params(self):
+        return {"word_count_thres": self.word_count_thres}
+
 
 class FlattenProcessor(Processor):
     def __init__(self, name):
@@ -119,10 +386,17 @@ class FlattenProcessor(Processor):
     def transform(self, word_lists, DEBUG=False):
         return [word for word_list in word_lists for word in word_list]
 
+    def stream(self, word_lists, DEBUG=False):
+        for word_list in word_lists:
+            yield from word_list
+
 
 title_pipeline = DataPipeline()
 title_pipeline.register_postprocessor(
-    GenSimProcessor("title_gensim_processor"), 30
+    GenSimProcessor(
+        "title_gensim_processor", tokenizer=make_tokenizer(TOKENIZER)
+    ),
+    30,
 )
 title_pipeline.register_postprocessor(
     FlattenProcessor("title_flatten_processor"), 60
@@ -133,7 +407,10 @@ title_pipeline.register_postprocessor(
 
 pgraph_pipeline = DataPipeline()
 pgraph_pipeline.register_postprocessor(
-    GenSimProcessor("pgraph_gensim_processor"), 30
+    GenSimProcessor(
+        "pgraph_gensim_processor", tokenizer=make_tokenizer(TOKENIZER)
+    ),
+    30,
 )
 pgraph_pipeline.register_postprocessor(
     FlattenProcessor("pgraph_flatten_processor"), 60
@@ -142,6 +419,25 @@ pgraph_pipeline.register_postprocessor(
     WordCountLimitProcessor("pgraph_word_limit_processor", 1000), 70
 )
 
+# tokenizes search keywords the same way as documents, so they can be looked
+# up in the keyword index
+keyword_pipeline = DataPipeline()
+keyword_pipeline.register_postprocessor(
+    GenSimProcessor(
+        "keyword_gensim_processor", tokenizer=make_tokenizer(TOKENIZER)
+    ),
+    30,
+)
+keyword_pipeline.register_postprocessor(
+    FlattenProcessor("keyword_flatten_processor"), 60
+)
+
+# tokenization is the inner loop of training and querying: run the
+# pipelines fused
+title_pipeline.compile()
+pgraph_pipeline.compile()
+keyword_pipeline.compile()
+
 
 def transform_instance(doc, title_pipeline, pgraph_pipeline, DEBUG=False):
     titles = doc["title"]
@@ -149,7 +445,6 @@ def transform_instance(doc, title_pipeline, pgraph_pipeline, DEBUG=False):
         titles = [titles]  # make title to list to concatenate with subtitles
     subtitles = doc.get("subtitles", [])
     titles = titles + subtitles
-    print("[INFO] transforming doc {}".format(doc["href"]))
     title_data = title_pipeline.transform(titles, DEBUG=DEBUG)
 
     pgraphs = doc.get("paragraphs", [])
@@ -158,25 +453,96 @@ def transform_instance(doc, title_pipeline, pgraph_pipeline, DEBUG=False):
     return title_data, pgraph_data
 
 
-def hypertune_kmeans(X_vectors, min_cluster=5, max_cluster=30, step=5):
-    # fit kmeans with different n_clusters, returning the "elbow" of the error curve
-    num_clusters = range(min_cluster, max_cluster, step)
-    ave_dists = []
-    for n in num_clusters:
-        kmeans = KMeans(n_clusters=n, random_state=0).fit(X_vectors)
+def preprocess_instance(
+    doc, exclude_site_processor, title_pipeline, pgraph_pipeline, DEBUG=False
+):
+    # training tokens of doc, or the reason it is dropped
+    try:
+        exclude_site_processor.transform(doc)
+    except AbortException:
+        return "excluded_site", None
+    title_data, pgraph_data = transform_instance(
+        doc, title_pipeline, pgraph_pipeline, DEBUG=DEBUG
+    )
+    if not title_data:
+        return "title", None
+    if not pgraph_data:
+        return "paragraphs", None
+    return None, title_data + pgraph_data
+
+
+def preprocess_fingerprint(
+    exclude_site_processor, title_pipeline, pgraph_pipeline
+):
+    # everything preprocess_instance's output depends on besides the doc
+    return json.dumps(
+        {
+            "gensim": gensim.__version__,
+            "exclude_site": exclude_site_processor.params(),
+            "title": title_pipeline.fingerprint(),
+            "pgraph": pgraph_pipeline.fingerprint(),
+        },
+        sort_keys=True,
+    )
 
-        labels = kmeans.labels_
-        ave_dist = np.sum(
-            np.sum(
-                np.square(X_vectors - kmeans.cluster_centers_[kmeans.labels_])
-            )
-        ) / len(X_vectors)
-        ave_dists.append(ave_dist)
 
-    plt.figure()
-    plt.plot(num_clusters, ave_dists)
-    plt.title("kmeans hyptertune")
-    plt.show()
+def make_preprocessor():
+    # Preprocessor running preprocess_instance with the training pipelines,
+    # reusing cached results of unchanged documents and, with
+    # PIPELINE_STATS_FILE, collecting the pipelines' stats
+    stats = None
+    if PIPELINE_STATS_FILE:
+        stats = PipelineStats()
+    title_pipeline.instrument(stats, per_stage=PIPELINE_STATS_PER_STAGE)
+    pgraph_pipeline.instrument(stats, per_stage=PIPELINE_STATS_PER_STAGE)
+    exclude_site_processor = ExcludeSitePreProcessor(
+        "exclude_site_preprocessor", EXCLUDE_SITES
+    )
+    token_cache = None
+    if TOKEN_CACHE_FILE:
+        token_cache = TokenCache(
+            TOKEN_CACHE_FILE,
+            preprocess_fingerprint(
+                exclude_site_processor, title_pipeline, pgraph_pipeline
+            ),
+        )
+    return Preprocessor(
+        partial(
+            preprocess_instance,
+            exclude_site_processor=exclude_site_processor,
+            title_pipeline=title_pipeline,
+            pgraph_pipeline=pgraph_pipeline,
+            DEBUG=DEBUG,
+        ),
+        workers=PREPROCESS_WORKERS,
+        batch_size=PREPROCESS_BATCH_SIZE,
+        cache=token_cache,
+        stats=stats,
+        profile_every=PROFILE_EVERY,
+    )
+
+
+def report_preprocessing(preprocessor):
+    num_dropped = sum(preprocessor.drops.values())
+    print("number of documents dropped: ", num_dropped)
+    print("dropped by reason: ", dict(preprocessor.drops))
+    token_cache = preprocessor.cache
+    if token_cache is not None:
+        print(
+            "token cache hit rate: {:.1%} ({} hits, {} misses)".format(
+                token_cache.hit_rate(), token_cache.hits, token_cache.misses
+            )
+        )
+        token_cache.close()
+    # stats of the documents transformed, cache hits excluded
+    if preprocessor.stats is not None:
+        print(preprocessor.stats.table())
+        preprocessor.stats.save(PIPELINE_STATS_FILE)
+        print("pipeline stats in {}".format(PIPELINE_STATS_FILE))
+    if preprocessor.profile is not None:
+        preprocessor.profile.dump_stats(PROFILE_FILE)
+        preprocessor.profile.sort_stats("cumulative").print_stats(20)
+        print("preprocessing profile in {}".format(PROFILE_FILE))
 
 
 if __name__ == "__main__":
@@ -186,152 +552,192 @@ if __name__ == "__main__":
     client = MongoClient("localhost", 27017, maxPoolSize=50)
     db = client.hndb
     collection = db["mongo_sites_2"]
-    orig_docs = list(collection.find().sort("_id", 1))
-    num_dropped = 0
 
-    X = []
-    to_keep = []
-    exclude_site_processor = ExcludeSitePreProcessor(
-        "exclude_site_preprocessor", EXCLUDE_SITES
+    # stream the corpus in batches to a pool of tokenizing processes,
+    # keeping only the tokens and the fields needed after training
+    preprocessor = make_preprocessor()
+    print("preprocessing with {} workers...".format(PREPROCESS_WORKERS))
+    cursor = (
+        collection.find(projection=PREPROCESS_PROJECTION)
+        .sort("_id", 1)
+        .batch_size(PREPROCESS_BATCH_SIZE)
     )
-    for i, doc in tqdm(enumerate(orig_docs)):
-        doc = exclude_site_processor.transform(doc)
-        title_data, pgraph_data = transform_instance(
-            doc, title_pipeline, pgraph_pipeline, DEBUG=DEBUG
-        )
-
-        if title_data and pgraph_data:
-            doc_data = title_data + pgraph_data
-            X.append(doc_data)
-            to_keep.append(i)
-        else:
-            num_dropped += 1
-
-    docs = [orig_docs[i] for i in to_keep]
-    print("number of documents dropped: ", num_dropped)
-
-    documents = [TaggedDocument(doc, [i]) for i, doc in enumerate(X)]
-
-    print("making model...")
-    model = Doc2Vec(
-        documents, vector_size=50, window=8, min_count=1, workers=4, epochs=30
+    # tokens go straight to an on-disk corpus file, one document per line,
+    # instead of being held in memory
+    docs = []
+    with CorpusWriter(CORPUS_FILE) as corpus_writer:
+        for doc, doc_data in tqdm(
+            preprocessor.run(cursor),
+            total=collection.estimated_document_count(),
+        ):
+            docs.append(doc)
+            corpus_writer.write(doc_data)
+    corpus = LineCorpus(CORPUS_FILE)
+    doc_lens = corpus_writer.doc_lens
+
+    report_preprocessing(preprocessor)
+
+    # keyword index over the same tokens, rows aligned with X_vectors
+    print("building keyword index...")
+    keyword_index = KeywordIndex.build(corpus.iter_words())
+
+    # the constructor builds the vocabulary and trains, once
+    print("training model...")
+    doc2vec_params = dict(
+        vector_size=50, window=8, min_count=1, workers=4, epochs=30
     )
+    if TRAIN_FROM_CORPUS_FILE:
+        # gensim's multi-core corpus_file path, tags are line numbers
+        model = Doc2Vec(corpus_file=CORPUS_FILE, **doc2vec_params)
+    else:
+        model = Doc2Vec(corpus, **doc2vec_params)
+
+    # saved with every array in its own file, so inference workers can
+    # memory map the weights
+    print("saving gensim model...")
+    model.save(MODEL_FILE, sep_limit=0)
 
-    print("building vocab with model...")
-    model.build_vocab(documents)
-
-    print("training model...")
-    model.train(
-        documents, total_examples=model.corpus_count, epochs=model.epochs
+    print(
+        "inferring document vectors with {} workers...".format(INFER_WORKERS)
+    )
+    X_vectors = infer_vectors(
+        MODEL_FILE,
+        corpus.iter_words(),
+        len(docs),
+        INFERRED_VECTORS_FILE,
+        workers=INFER_WORKERS,
+        seed=INFER_SEED,
     )
 
-    ranks = []
-    second_ranks = []
-    X_vectors = []
+    # sanity check: the inferred vector of a document should be closest to
+    # its own trained vector
     print("performing sanity check...")
-    for doc_id in tqdm(range(len(docs))):
-        inferred_vector = model.infer_vector(documents[doc_id].words)
-        X_vectors.append(inferred_vector)
-        sims = model.dv.most_similar([inferred_vector], topn=len(model.dv))
-        rank = [docid for docid, sim in sims].index(doc_id)
-        ranks.append(rank)
-
-    second_ranks.append(sims[1])
-
-    # sanity check
-    counter = Counter(ranks)
-    print(counter)
+    sanity_report = self_rank_report(
+        model, X_vectors, sample_size=SANITY_SAMPLE_SIZE
+    )
+    write_report(sanity_report, SANITY_REPORT_FILE)
+    print(
+        "self rank 0: {:.1%} of {} docs, median rank {}, report in {}".format(
+            sanity_report["rank_0"],
+            sanity_report["num_evaluated"],
+            sanity_report["rank_median"],
+            SANITY_REPORT_FILE,
+        )
+    )
 
     # standardize X_vectors
     print("standardizing feature vectors...")
     scaler = MinMaxScaler()
     standardized_X_vectors = scaler.fit_transform(X_vectors)
 
-    # save X_vectors and model
-    print("saving gensim model...")
-    model.save("gensim.model")
-
     # save vectors
     print("saving feature vectors...")
-    with open("X_vectors.npy", "wb") as f:
+    with open(X_VECTORS_FILE, "wb") as f:
         np.save(f, standardized_X_vectors)
 
+    n_clusters = NUM_CLUSTERS
     if DO_HYPTERTUNE:
         print("hypertuning kmeans parameters...")
-        hypertune_kmeans(
-            standardized_X_vectors, min_cluster=50, max_cluster=1000, step=20
+        sweep = sweep_kmeans(
+            X_VECTORS_FILE,
+            SWEEP_K_RANGE,
+            metric=SWEEP_METRIC,
+            workers=SWEEP_WORKERS,
+        )
+        save_sweep(sweep, SWEEP_REPORT)
+        n_clusters = sweep["best_k"]
+        print(
+            "best n_clusters by {}: {}, curve in {}.json/png".format(
+                SWEEP_METRIC, n_clusters, SWEEP_REPORT
+            )
         )
 
     # fit model
     print("fitting kmeans model...")
-    kmeans = KMeans(n_clusters=30, random_state=3).fit(standardized_X_vectors)
+    kmeans = KMeans(n_clusters=n_clusters, random_state=3).fit(
+        standardized_X_vectors
+    )
 
     # save model
     print("saving kmeans model...")
     with open("model.pkl", "wb") as f:
         pickle.dump(kmeans, f)
 
+    print("inferring the drift baseline...")
+    rng = np.random.default_rng(INFER_SEED)
+    baseline_rows = np.sort(
+        rng.choice(
+            len(docs), min(DRIFT_BASELINE_SIZE, len(docs)), replace=False
+        )
+    )
+    drift_baseline = scaler.transform(
+        infer_vectors(
+            MODEL_FILE,
+            corpus.iter_rows(baseline_rows),
+            len(baseline_rows),
+            DRIFT_BASELINE_VECTORS_FILE,
+            workers=INFER_WORKERS,
+            # past the seeds of every row, so no vector is inferred again
+            # with the seed it was fitted with
+            seed=INFER_SEED + len(docs),
+        )
+    )
+
+    # export the inference-only bundle served by the app. doc_ids map mongo
+    # _id to X_vectors row, so the app can look up stored vectors instead of
+    # re-inferring them; the metadata store holds what it renders per row
+    print("exporting serving bundle...")
+    bundle_path = export_bundle(
+        BUNDLE_DIR,
+        model,
+        kmeans,
+        scaler,
+        standardized_X_vectors,
+        [str(doc["_id"]) for doc in docs],
+        keyword_index,
+        MetadataStore.build(docs),
+        dropped_ids=preprocessor.dropped_ids,
+        drift_baseline=drift_baseline,
+        make_current=False,
+    )
+    print("saved bundle to {}".format(bundle_path))
+
     # analysis
     labels = kmeans.labels_
-    centroids = kmeans.cluster_centers_
-
-    # plot distance between centroids
-    centroid_dists = []
-    for centroidi in centroids:
-        tmp = []
-        for centroidj in centroids:
-            tmp.append(np.linalg.norm(centroidj - centroidi))
-        centroid_dists.append(tmp)
-    centroid_dists = np.array(centroid_dists)
-
-    plt.figure()
-    plt.imshow(centroid_dists, cmap="hot", interpolation="nearest")
-    plt.title("distance between centroids")
-    plt.show()
-
-    # plot label counts
-    label_counts = Counter(labels)
-    plt.figure()
-    plt.bar(label_counts.keys(), label_counts.values())
-    plt.title("count by label")
-    plt.show()
-
-    doc_len_by_labels = {}
-    for i, doc in enumerate(documents):
-        label = labels[i]
-        doc_len = len(documents[i].words)
-
-        doc_len_by_labels.setdefault(label, [])
-        doc_len_by_labels[label].append(doc_len)
-
-    plot_data = {
-        label: np.mean(docs_len)
-        for label, docs_len in doc_len_by_labels.items()
-    }
-    plt.figure()
-    plt.bar(plot_data.keys(), plot_data.values())
-    plt.title("document length by label")
-    plt.show()
+    print("writing cluster analysis to {}...".format(ANALYSIS_DIR))
+    write_analysis(
+        ANALYSIS_DIR,
+        kmeans.cluster_centers_,
+        labels,
+        doc_lens,
+        X=standardized_X_vectors if ANALYSIS_PCA else None,
+    )
 
     print("saving labels...")
     with open("labels.npy", "wb") as f:
         np.save(f, labels)
 
-    for i, label in enumerate(labels):
-        docs[i]["label"] = label.item()
-    # save docs to DB with labels
-    db["filtered_hn_sites"].drop()
-    collection = db["filtered_hn_sites"]
-    collection.insert_many(docs)
-
-    # plot PCA decomposition
-    # pca = PCA(n_components=2)
-    # X_transformed = pca.fit_transform(standardized_X_vectors)
-
-    # plt.scatter(X_transformed[:,0], X_transformed[:, 1], c=kmeans.labels_)
-    # plt.title("Kmeans clustering on 300-dimensional feature vectors")
-    # plt.legend()
-    # plt.show()
+    # save labels to DB. The app's collection is updated in place or
+    # swapped in whole, so it is never empty or partial.
+    print("writing labels back ({} mode)...".format(WRITEBACK_MODE))
+    label_by_id = {
+        doc["_id"]: label.item() for doc, label in zip(docs, labels)
+    }
+    writeback_stats = write_back(
+        db,
+        collection,
+        "filtered_hn_sites",
+        label_by_id,
+        mode=WRITEBACK_MODE,
+        batch_size=WRITEBACK_BATCH_SIZE,
+    )
+    print("write back: {}".format(dict(writeback_stats)))
+
+    # point the app at the new bundle only once the labelled docs it was
+    # trained on are in place; running apps hot swap to it
+    set_current_version(BUNDLE_DIR, os.path.basename(bundle_path))
+    for version in prune_versions(BUNDLE_DIR, KEEP_VERSIONS):
+        print("deleted bundle version {}".format(version))
 
 
 # class StripProcessor(PostProcessor):
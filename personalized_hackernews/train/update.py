@@ -0,0 +1,223 @@
+# incremental update: embed and label documents crawled since the served
+# bundle was trained, without retraining Doc2Vec or kmeans.
+# Run from personalized_hackernews/ with `python -m train.update`.
+from pymongo import MongoClient
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import pairwise_distances_argmin_min
+from tqdm import tqdm
+from train.bundle import (
+    link_model,
+    load_bundle,
+    prune_versions,
+    set_current_version,
+    write_bundle,
+)
+from train.corpus import CorpusWriter, LineCorpus
+from train.inference import infer_vectors
+from train.keyword_index import KeywordIndex
+from train.preprocess import PREPROCESS_PROJECTION
+from train.train import (
+    BUNDLE_DIR,
+    INFER_SEED,
+    INFER_WORKERS,
+    KEEP_VERSIONS,
+    PREPROCESS_BATCH_SIZE,
+    WRITEBACK_BATCH_SIZE,
+    make_preprocessor,
+    report_preprocessing,
+)
+from train.writeback import set_labels
+
+import numpy as np
+import os
+
+UPDATE_CORPUS_FILE = "update_corpus.txt"
+UPDATE_VECTORS_FILE = "update_vectors.npy"
+# "centroids" labels new docs with the nearest served centroid;
+# "partial_fit" also moves the centroids towards them with MiniBatchKMeans
+ASSIGN_MODE = "centroids"
+# relative increase of the mean distance to the assigned centroid, of docs
+# added since the last full training run, past which to retrain
+DRIFT_THRESHOLD = 0.2
+
+
+def find_new_ids(collection, bundle):
+    # _ids of the source collection that are neither rows of the bundle nor
+    # dropped by the preprocessing of an earlier run, in _id order
+    ids = [
+        doc["_id"]
+        for doc in collection.find(projection={"_id": 1}).sort("_id", 1)
+    ]
+    str_ids = np.asarray([str(i) for i in ids])
+    known = np.isin(str_ids, bundle.doc_ids) | np.isin(
+        str_ids, bundle.dropped_ids
+    )
+    return [doc_id for doc_id, is_known in zip(ids, known) if not is_known]
+
+
+def iter_documents(collection, ids, batch_size, projection=None):
+    for start in range(0, len(ids), batch_size):
+        yield from collection.find(
+            {"_id": {"$in": ids[start : start + batch_size]}},
+            projection=projection,
+        ).sort("_id", 1)
+
+
+def assign_labels(bundle, scaled_vectors, mode=ASSIGN_MODE):
+    # (centroids, labels of scaled_vectors)
+    assert mode in ["centroids", "partial_fit"]
+    centroids = np.asarray(bundle.centroids)
+    if mode == "centroids":
+        return centroids, bundle.predict(scaled_vectors)
+
+    # seed the model with the served centroids, weighted by cluster size,
+    # so the new docs move them as much as that many docs would
+    kmeans = MiniBatchKMeans(
+        n_clusters=len(centroids),
+        init=centroids,
+        n_init=1,
+        reassignment_ratio=0,
+        random_state=0,
+    )
+    kmeans.partial_fit(centroids, sample_weight=np.diff(bundle.index.offsets))
+    kmeans.partial_fit(scaled_vectors)
+    return kmeans.cluster_centers_, kmeans.predict(scaled_vectors)
+
+
+def drift_report(centroids, vectors, labels, num_trained_docs, baseline):
+    # distances to the assigned centroid of the docs added by updates,
+    # compared with those of `baseline`, training docs inferred again at
+    # training time. The vectors kmeans was fitted on sit closer to the
+    # centroids than any newly inferred vector, so they are no baseline.
+    dists = np.linalg.norm(vectors - centroids[labels], axis=1)
+    added = dists[num_trained_docs:]
+    baseline_dists = np.empty(0)
+    if len(baseline):
+        _, baseline_dists = pairwise_distances_argmin_min(baseline, centroids)
+    mean_baseline = float(baseline_dists.mean()) if len(baseline) else 0.0
+    return {
+        "num_trained_docs": num_trained_docs,
+        "num_added_docs": len(added),
+        "num_baseline_docs": len(baseline),
+        "baseline_mean_dist": mean_baseline,
+        "added_mean_dist": float(added.mean()),
+        "drift": (
+            float(added.mean()) / mean_baseline - 1 if mean_baseline else 0.0
+        ),
+        # added docs farther from their centroid than 95% of the baseline
+        "outlier_fraction": (
+            float(np.mean(added > np.percentile(baseline_dists, 95)))
+            if len(baseline)
+            else 0.0
+        ),
+    }
+
+
+if __name__ == "__main__":
+    client = MongoClient("localhost", 27017, maxPoolSize=50)
+    db = client.hndb
+    collection = db["mongo_sites_2"]
+
+    bundle = load_bundle(BUNDLE_DIR)
+    num_docs = len(bundle.labels)
+    num_trained_docs = bundle.manifest.get("num_trained_docs", num_docs)
+    print("updating bundle {} ({} docs)".format(bundle.version, num_docs))
+
+    new_ids = find_new_ids(collection, bundle)
+    print("{} documents not in the bundle".format(len(new_ids)))
+    if not new_ids:
+        raise SystemExit(0)
+
+    preprocessor = make_preprocessor()
+    docs = []
+    with CorpusWriter(UPDATE_CORPUS_FILE) as corpus_writer:
+        for doc, doc_data in tqdm(
+            preprocessor.run(
+                iter_documents(
+                    collection,
+                    new_ids,
+                    PREPROCESS_BATCH_SIZE,
+                    projection=PREPROCESS_PROJECTION,
+                )
+            ),
+            total=len(new_ids),
+        ):
+            docs.append(doc)
+            corpus_writer.write(doc_data)
+    report_preprocessing(preprocessor)
+    if not docs:
+        # nothing to add; the dropped docs are tried again next time
+        raise SystemExit(0)
+    corpus = LineCorpus(UPDATE_CORPUS_FILE)
+
+    print("inferring {} document vectors...".format(len(docs)))
+    scaled_vectors = bundle.scale(
+        infer_vectors(
+            bundle.model_path,
+            corpus.iter_words(),
+            len(docs),
+            UPDATE_VECTORS_FILE,
+            workers=INFER_WORKERS,
+            seed=INFER_SEED,
+        )
+    )
+    centroids, new_labels = assign_labels(bundle, scaled_vectors)
+
+    # the served arrays with the new docs appended
+    vectors = np.concatenate(
+        [bundle.vectors(np.arange(num_docs)), scaled_vectors]
+    )
+    labels = np.concatenate([bundle.labels, new_labels])
+    drift = drift_report(
+        centroids, vectors, labels, num_trained_docs, bundle.drift_baseline
+    )
+    print(
+        "drift since the last full training run: {:.1%}".format(drift["drift"])
+    )
+    if drift["drift"] > DRIFT_THRESHOLD:
+        print(
+            "drift is over {:.0%}, run a full retrain with "
+            "`python -m train.train`".format(DRIFT_THRESHOLD)
+        )
+
+    print("exporting serving bundle...")
+    bundle_path = write_bundle(
+        BUNDLE_DIR,
+        centroids,
+        labels,
+        bundle.scaler_min,
+        bundle.scaler_scale,
+        vectors,
+        np.concatenate([bundle.doc_ids, [str(doc["_id"]) for doc in docs]]),
+        bundle.keyword_index.merge(KeywordIndex.build(corpus.iter_words())),
+        bundle.metadata.append(docs),
+        lambda path: link_model(bundle.model_path, path),
+        dropped_ids=np.concatenate(
+            [
+                bundle.dropped_ids,
+                np.asarray(preprocessor.dropped_ids, dtype=str),
+            ]
+        ),
+        drift_baseline=bundle.drift_baseline,
+        manifest={
+            "num_trained_docs": num_trained_docs,
+            "updated_from": bundle.version,
+            "assign_mode": ASSIGN_MODE,
+            "drift": drift,
+            "needs_retrain": drift["drift"] > DRIFT_THRESHOLD,
+        },
+        make_current=False,
+    )
+    print("saved bundle to {}".format(bundle_path))
+
+    # label only the new docs; the docs of earlier versions keep theirs
+    set_labels(
+        db["filtered_hn_sites"],
+        collection,
+        {doc["_id"]: int(label) for doc, label in zip(docs, new_labels)},
+        batch_size=WRITEBACK_BATCH_SIZE,
+    )
+
+    set_current_version(BUNDLE_DIR, os.path.basename(bundle_path))
+    for version in prune_versions(BUNDLE_DIR, KEEP_VERSIONS):
+        print("deleted bundle version {}".format(version))
@@ -0,0 +1,203 @@
+import numpy as np
+import os
+
+
+class ClusterIndex:
+    """
+    Inverted-file index over document vectors that uses the fitted kmeans
+    centroids as a coarse quantizer.
+
+    Rows are grouped by cluster label into contiguous float32 blocks, so
+    ranking the documents of a cluster is a single matrix-vector product
+    over one block instead of masking and scanning the whole corpus. A
+    query probes the `nprobe` clusters whose centroids are closest to it.
+    """
+
+    ARRAYS = [
+        "centroids",
+        "row_ids",
+        "offsets",
+        "blocks",
+        "sq_norms",
+        "positions",
+    ]
+
+    def __init__(
+        self,
+        centroids,
+        row_ids,
+        offsets,
+        blocks,
+        sq_norms,
+        positions,
+        nprobe=1,
+    ):
+        self.centroids = centroids
+        self.row_ids = row_ids
+        self.offsets = offsets
+        self.blocks = blocks
+        self.sq_norms = sq_norms
+        # position of every row inside the blocks, to look up vectors by row
+        self.positions = positions
+        self.centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, centroids, labels, vectors, nprobe=1):
+        centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        labels = np.asarray(labels)
+        # posting arrays: row ids of every cluster, stored back to back and
+        # delimited by offsets. A stable sort keeps row ids ascending inside
+        # each posting array.
+        order = np.argsort(labels, kind="stable")
+        offsets = np.searchsorted(labels[order], np.arange(len(centroids) + 1))
+        blocks = np.ascontiguousarray(vectors[order], dtype=np.float32)
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+        return cls(
+            centroids,
+            order.astype(np.int64),
+            offsets,
+            blocks,
+            np.einsum("ij,ij->i", blocks, blocks),
+            positions,
+            nprobe=nprobe,
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode=None, nprobe=1):
+        # with mmap_mode="r" the vector blocks are paged in from disk and
+        # shared between processes
+        arrays = [
+            np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in cls.ARRAYS
+        ]
+        return cls(*arrays, nprobe=nprobe)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @property
+    def n_clusters(self):
+        return len(self.centroids)
+
+    def cluster_size(self, label):
+        return int(self.offsets[label + 1] - self.offsets[label])
+
+    def vectors(self, rows):
+        # vectors of the given rows, in row order
+        return self.blocks[self.positions[rows]]
+
+    def predict(self, queries):
+        # label of the nearest centroid for every query, like KMeans.predict
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        sq_dists = self.centroid_sq_norms - 2 * (queries @ self.centroids.T)
+        return np.argmin(sq_dists, axis=1)
+
+    def posting(self, label):
+        # row ids and vectors of one cluster (views, no copies)
+        start, end = self.offsets[label], self.offsets[label + 1]
+        return self.row_ids[start:end], self.blocks[start:end]
+
+    def nearest_clusters(self, query, nprobe=1):
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        sq_dists = self.centroid_sq_norms - 2 * (self.centroids @ query)
+        nprobe = min(nprobe, self.n_clusters)
+        if nprobe == self.n_clusters:
+            return np.argsort(sq_dists)
+        probe = np.argpartition(sq_dists, nprobe - 1)[:nprobe]
+        return probe[np.argsort(sq_dists[probe])]
+
+    def search(self, query, k=10, nprobe=None, labels=None, exact=False):
+        # return the row ids and euclidean distances of the `k` rows closest
+        # to `query`, nearest first. Candidates come from the `nprobe`
+        # nearest clusters, the given `labels`, or every row if `exact`.
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if exact:
+            ids, block, sq_norms = self.row_ids, self.blocks, self.sq_norms
+        else:
+            if labels is None:
+                labels = self.nearest_clusters(
+                    query, nprobe=nprobe or self.nprobe
+                )
+            ids, block, sq_norms = self._gather(np.atleast_1d(labels))
+
+        if len(ids) == 0:
+            return ids, np.empty(0, dtype=np.float32)
+
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2
+        sq_dists = sq_norms - 2 * (block @ query) + query @ query
+        top = self._top_k(sq_dists, k)
+        return ids[top], np.sqrt(np.maximum(sq_dists[top], 0))
+
+    def search_batch(self, queries, labels, k=10):
+        # search many queries at once, each within the cluster given by
+        # labels. Queries of the same cluster are ranked with one matrix
+        # product against its block; returns a (row ids, distances) pair
+        # per query, nearest first.
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        labels = np.asarray(labels).reshape(-1)
+        results = [None] * len(queries)
+        for label in np.unique(labels):
+            members = np.nonzero(labels == label)[0]
+            ids, block, sq_norms = self._gather([label])
+            group = queries[members]
+            sq_dists = (
+                sq_norms[:, None]
+                - 2 * (block @ group.T)
+                + np.einsum("ij,ij->i", group, group)[None, :]
+            )
+            if k is None or k >= len(ids):
+                top = np.argsort(sq_dists, axis=0, kind="stable")
+            else:
+                top = np.argpartition(sq_dists, k - 1, axis=0)[:k]
+                order = np.argsort(
+                    np.take_along_axis(sq_dists, top, axis=0),
+                    axis=0,
+                    kind="stable",
+                )
+                top = np.take_along_axis(top, order, axis=0)
+            top_dists = np.sqrt(
+                np.maximum(np.take_along_axis(sq_dists, top, axis=0), 0)
+            )
+            for j, member in enumerate(members):
+                results[member] = (ids[top[:, j]], top_dists[:, j])
+        return results
+
+    def recall_at_k(self, queries, k=10, nprobe=None):
+        # fraction of the exact top-k that the probed search also returns
+        hits = 0
+        for query in np.atleast_2d(queries):
+            approx, _ = self.search(query, k=k, nprobe=nprobe)
+            exact, _ = self.search(query, k=k, exact=True)
+            hits += len(np.intersect1d(approx, exact))
+        return hits / (len(np.atleast_2d(queries)) * min(k, len(self)))
+
+    def _gather(self, labels):
+        if len(labels) == 1:
+            label = labels[0]
+            start, end = self.offsets[label], self.offsets[label + 1]
+            return (
+                self.row_ids[start:end],
+                self.blocks[start:end],
+                self.sq_norms[start:end],
+            )
+        sel = np.concatenate(
+            [
+                np.arange(self.offsets[label], self.offsets[label + 1])
+                for label in labels
+            ]
+        )
+        return self.row_ids[sel], self.blocks[sel], self.sq_norms[sel]
+
+    @staticmethod
+    def _top_k(sq_dists, k):
+        if k is None or k >= len(sq_dists):
+            return np.argsort(sq_dists, kind="stable")
+        top = np.argpartition(sq_dists, k - 1)[:k]
+        return top[np.argsort(sq_dists[top], kind="stable")]
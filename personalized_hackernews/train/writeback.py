@@ -0,0 +1,134 @@
+from collections import Counter
+from pymongo import ReplaceOne, UpdateOne
+from tqdm import tqdm
+from train.preprocess import iter_batches
+
+WRITEBACK_BATCH_SIZE = 1000  # documents per bulk write
+STAGING_SUFFIX = "_staging"
+
+
+def _chunks(items, batch_size, desc):
+    # batches of items, with a progress bar
+    return tqdm(
+        (
+            items[start : start + batch_size]
+            for start in range(0, len(items), batch_size)
+        ),
+        total=-(-len(items) // batch_size),
+        desc=desc,
+        unit="batch",
+    )
+
+
+def copy_labelled(target, source, label_by_id, ids, batch_size):
+    # upsert the full source documents of ids into target with their label
+    num_copied = 0
+    for chunk in _chunks(ids, batch_size, "copying documents"):
+        requests = []
+        for doc in source.find({"_id": {"$in": chunk}}):
+            doc["label"] = label_by_id[doc["_id"]]
+            requests.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+        if requests:
+            result = target.bulk_write(requests, ordered=False)
+            num_copied += result.upserted_count + result.modified_count
+    return num_copied
+
+
+def set_labels(
+    target,
+    source,
+    label_by_id,
+    batch_size=WRITEBACK_BATCH_SIZE,
+    prune=False,
+):
+    """
+    Writes label_by_id into target in place: labels of documents already
+    in target are updated with unordered bulk $set operations, documents
+    labelled for the first time are copied from source, and with prune,
+    documents of target that are not in label_by_id are deleted. Only
+    labels go over the wire for documents target already has.
+    """
+    stats = Counter()
+    ids = list(label_by_id)
+    for chunk in _chunks(ids, batch_size, "setting labels"):
+        result = target.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": doc_id}, {"$set": {"label": label_by_id[doc_id]}}
+                )
+                for doc_id in chunk
+            ],
+            ordered=False,
+        )
+        stats["matched"] += result.matched_count
+        stats["modified"] += result.modified_count
+
+    if stats["matched"] == len(ids) and not prune:
+        return stats
+    existing = set(doc["_id"] for doc in target.find(projection={"_id": 1}))
+    missing = [doc_id for doc_id in ids if doc_id not in existing]
+    stats["copied"] = copy_labelled(
+        target, source, label_by_id, missing, batch_size
+    )
+    if prune:
+        stale = [doc_id for doc_id in existing if doc_id not in label_by_id]
+        for chunk in _chunks(stale, batch_size, "deleting documents"):
+            result = target.delete_many({"_id": {"$in": chunk}})
+            stats["deleted"] += result.deleted_count
+    return stats
+
+
+def swap_labelled(
+    db, source, target_name, label_by_id, batch_size=WRITEBACK_BATCH_SIZE
+):
+    """
+    Rebuilds target_name from scratch: the labelled source documents are
+    written to a staging collection, which then atomically replaces the
+    target with renameCollection, so readers never see it empty or
+    partially written.
+    """
+    staging = db[target_name + STAGING_SUFFIX]
+    staging.drop()
+    stats = Counter()
+    for batch in tqdm(
+        iter_batches(
+            source.find().sort("_id", 1).batch_size(batch_size), batch_size
+        ),
+        total=-(-source.estimated_document_count() // batch_size),
+        desc="staging documents",
+        unit="batch",
+    ):
+        labelled = []
+        for doc in batch:
+            if doc["_id"] in label_by_id:
+                doc["label"] = label_by_id[doc["_id"]]
+                labelled.append(doc)
+        if labelled:
+            staging.insert_many(labelled, ordered=False)
+            stats["copied"] += len(labelled)
+    staging.rename(target_name, dropTarget=True)
+    return stats
+
+
+def write_back(
+    db,
+    source,
+    target_name,
+    label_by_id,
+    mode="labels",
+    batch_size=WRITEBACK_BATCH_SIZE,
+):
+    # make target_name hold exactly the documents of label_by_id, labelled,
+    # with set_labels ("labels") or swap_labelled ("swap")
+    assert mode in ["labels", "swap"]
+    if mode == "labels":
+        return set_labels(
+            db[target_name],
+            source,
+            label_by_id,
+            batch_size=batch_size,
+            prune=True,
+        )
+    return swap_labelled(
+        db, source, target_name, label_by_id, batch_size=batch_size
+    )